@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from mutation_screen import match_mutation, match_mutation_indexed, build_mutation_index
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+GENES = ['HA1', 'HA2', 'SigPep']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Compare match_mutation against the indexed curated-mutation matcher.')
+    parser.add_argument('-c', '--curated', type=int, default=500, help='Number of curated individual mutations.')
+    parser.add_argument('-n', '--observed', type=int, default=50000, help='Number of observed mutations to look up.')
+    parser.add_argument('-w', '--wildcard_share', type=float, default=0.2, help='Fraction of curated mutations using the X wildcard.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of timing repeats (best is reported).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed.')
+    return parser.parse_args()
+
+# Function to generate a random curated list and a stream of observed mutations
+def generate_mutations(n_curated, n_observed, wildcard_share, rng):
+    curated = []
+    for _ in range(n_curated):
+        alt = 'X' if rng.random() < wildcard_share else rng.choice(AMINO_ACIDS)
+        curated.append(f"{rng.choice(GENES)}:{rng.choice(AMINO_ACIDS)}{rng.randint(1, 570)}{alt}")
+
+    observed = []
+    for _ in range(n_observed):
+        if rng.random() < 0.1:
+            # Reuse a curated position so a realistic share of lookups are hits
+            gene, aa = rng.choice(curated).split(':', 1)
+            observed.append(f"{gene}:{aa[:-1]}{rng.choice(AMINO_ACIDS + '-')}")
+        else:
+            observed.append(f"{rng.choice(GENES)}:{rng.choice(AMINO_ACIDS)}{rng.randint(1, 570)}{rng.choice(AMINO_ACIDS + '-')}")
+    return curated, observed
+
+def main():
+    args = parse_arguments()
+    rng = random.Random(args.seed)
+    curated, observed = generate_mutations(args.curated, args.observed, args.wildcard_share, rng)
+
+    mutation_index = build_mutation_index(curated)
+
+    linear_hits = [mut for mut in observed if match_mutation(mut, curated)]
+    indexed_hits = [mut for mut in observed if match_mutation_indexed(mut, mutation_index)]
+    if linear_hits != indexed_hits:
+        print("ERROR: Indexed matcher disagrees with match_mutation.", file=sys.stderr)
+        sys.exit(1)
+
+    linear_time = min(timeit.repeat(lambda: [match_mutation(mut, curated) for mut in observed], number=1, repeat=args.repeat))
+    build_time = min(timeit.repeat(lambda: build_mutation_index(curated), number=1, repeat=args.repeat))
+    indexed_time = min(timeit.repeat(lambda: [match_mutation_indexed(mut, mutation_index) for mut in observed], number=1, repeat=args.repeat))
+
+    print(f"Curated mutations: {args.curated}, observed mutations: {args.observed}, matches: {len(indexed_hits)}")
+    print(f"match_mutation:         {linear_time:.4f} s")
+    print(f"match_mutation_indexed: {indexed_time:.4f} s (+ {build_time:.4f} s index build)")
+    print(f"Speedup: {linear_time / indexed_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
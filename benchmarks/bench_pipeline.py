@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN_DIR)
+
+from instrumentation import peak_rss_mb
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'nextclade_datasets')
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+CODON_TABLE = {
+    f"{a}{b}{c}": aa for (a, b, c), aa in zip(
+        ((a, b, c) for a in 'TCAG' for b in 'TCAG' for c in 'TCAG'),
+        'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+    )
+}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Time mutation screening, frequency tables and the combiner on synthetic Nextclade output.')
+    parser.add_argument('-n', '--sizes', default='1000,10000,100000,1000000', help='Comma-separated sequence counts per dataset (default: 1000,10000,100000,1000000).')
+    parser.add_argument('-d', '--datasets', default=None, help='Comma-separated bundled Nextclade datasets to model (default: all).')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='JSON file to write the results to.')
+    parser.add_argument('--compare', default=None, help='Earlier results JSON; print the change per benchmark and exit 1 if any got slower than --tolerance.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown for --compare (default: 0.2).')
+    parser.add_argument('--chunk_size', type=int, default=50000, help='Chunk size passed to process_file and the combiner (default: 50000; 0 reads whole files).')
+    parser.add_argument('--mutation_density', type=float, default=12, help='Mean aa substitutions per sequence (default: 12).')
+    parser.add_argument('--deletion_rate', type=float, default=0.3, help='Mean aa deletions per sequence (default: 0.3).')
+    parser.add_argument('--insertion_rate', type=float, default=0.05, help='Mean aa insertions per sequence (default: 0.05).')
+    parser.add_argument('--failure_share', type=float, default=0.03, help='Fraction of sequences Nextclade failed to analyse (default: 0.03).')
+    parser.add_argument('--sites', type=int, default=200, help='Number of variable positions mutations are drawn from (default: 200).')
+    parser.add_argument('-c', '--curated', type=int, default=60, help='Curated individual mutations per list (default: 60).')
+    parser.add_argument('-w', '--wildcard_share', type=float, default=0.1, help='Fraction of curated mutations using the X wildcard (default: 0.1).')
+    parser.add_argument('--combinations', type=int, default=15, help='Curated combinations per list (default: 15).')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Run each measurement this many times and keep the fastest (default: 3).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed.')
+    parser.add_argument('--keep', default=None, help='Keep the generated inputs and outputs in this directory instead of a temporary one.')
+    return parser.parse_args()
+
+# Function to read the reference protein of a bundled dataset from its FASTA and GFF3 annotation
+def load_reference_protein(dataset_dir):
+    with open(os.path.join(dataset_dir, 'reference.fasta')) as handle:
+        reference = ''.join(line.strip() for line in handle if not line.startswith('>')).upper()
+
+    with open(os.path.join(dataset_dir, 'genome_annotation.gff3')) as handle:
+        for line in handle:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 9 and fields[2] == 'gene':
+                attributes = dict(item.split('=', 1) for item in fields[8].split(';') if '=' in item)
+                start, end = int(fields[3]), int(fields[4])
+                break
+        else:
+            raise ValueError(f"No gene feature found in {dataset_dir}")
+
+    cds = reference[start - 1:end]
+    protein = ''.join(CODON_TABLE.get(cds[i:i + 3], 'X') for i in range(0, len(cds) - 2, 3))
+    return attributes.get('Name', 'HA'), protein.split('*', 1)[0]
+
+# Function to draw per-sequence mutations at a skewed set of sites, one sorted entry per site
+def draw_mutations(rng, n_sequences, mean, sites, weights, labels):
+    """
+    labels[i, j] is the string for alternative j at sites[i]. Returns one
+    comma-separated string per sequence.
+    """
+    counts = rng.poisson(mean, n_sequences)
+    rows = np.repeat(np.arange(n_sequences), counts)
+    site = rng.choice(len(sites), size=len(rows), p=weights)
+    alt = rng.integers(0, labels.shape[1], size=len(rows))
+
+    # Keep one change per (sequence, site), ordered by position as Nextclade reports them
+    order = np.lexsort((sites[site], rows))
+    rows, site, alt = rows[order], site[order], alt[order]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[1:] = (rows[1:] != rows[:-1]) | (site[1:] != site[:-1])
+    rows, values = rows[keep], labels[site[keep], alt[keep]]
+
+    bounds = np.searchsorted(rows, np.arange(n_sequences + 1))
+    return [','.join(values[bounds[i]:bounds[i + 1]]) for i in range(n_sequences)]
+
+# Function to write a synthetic Nextclade TSV for one dataset
+def generate_nextclade_tsv(path, gene, protein, n_sequences, args, rng):
+    positions = np.arange(1, len(protein) + 1)
+    sites = np.sort(rng.choice(positions, size=min(args.sites, len(protein)), replace=False))
+    # A few sites dominate, like clade-defining changes
+    weights = 1.0 / np.arange(1, len(sites) + 1)
+    weights = rng.permutation(weights / weights.sum())
+
+    substitutions = np.array([
+        [f"{gene}:{protein[p - 1]}{p}{alt}" for alt in AMINO_ACIDS.replace(protein[p - 1], '')[:19]] for p in sites
+    ], dtype=object)
+    deletions = np.array([[f"{gene}:{protein[p - 1]}{p}-"] for p in sites], dtype=object)
+    insertions = np.array([[f"{gene}:{p}:{a}{b}" for a, b in zip(AMINO_ACIDS[:5], AMINO_ACIDS[5:10])] for p in sites], dtype=object)
+
+    failed = rng.random(n_sequences) < args.failure_share
+    df = pd.DataFrame({
+        'index': np.arange(n_sequences),
+        'seqName': [f"A/synthetic/{gene}/{i}/2024" for i in range(n_sequences)],
+        'clade': '2.3.4.4b',
+        'qc.overallScore': rng.integers(0, 100, n_sequences).astype(str),
+        'qc.overallStatus': 'good',
+        'aaSubstitutions': draw_mutations(rng, n_sequences, args.mutation_density, sites, weights, substitutions),
+        'aaDeletions': draw_mutations(rng, n_sequences, args.deletion_rate, sites, weights, deletions),
+        'aaInsertions': draw_mutations(rng, n_sequences, args.insertion_rate, sites, weights, insertions),
+        'coverage': np.round(rng.uniform(0.9, 1.0, n_sequences), 4).astype(str),
+        'errors': '',
+    })
+    df.loc[failed, ['clade', 'qc.overallScore', 'qc.overallStatus', 'aaSubstitutions', 'aaDeletions', 'aaInsertions', 'coverage']] = ''
+    df.loc[failed, 'errors'] = 'Unable to align: seed matching failed'
+    df.to_csv(path, sep='\t', index=False)
+    return sites, weights
+
+# Function to write a synthetic curated list whose mutations partly overlap the variable sites
+def generate_mutation_list(path, gene, protein, sites, weights, args, rng):
+    rows = []
+    individual = []
+    for i in range(args.curated):
+        # Half the list sits on variable sites so screening finds hits
+        p = int(rng.choice(sites, p=weights)) if i % 2 == 0 else int(rng.integers(1, len(protein) + 1))
+        alt = 'X' if rng.random() < args.wildcard_share else rng.choice(list(AMINO_ACIDS.replace(protein[p - 1], '')))
+        individual.append(f"{protein[p - 1]}{p}{alt}")
+        rows.append((gene, individual[-1], 'No', 'synthetic'))
+
+    for _ in range(args.combinations):
+        members = []
+        for aa in rng.choice(individual, size=int(rng.integers(2, 4)), replace=False):
+            # Some members require the reference residue, which is inferred rather than observed
+            members.append(aa if rng.random() < 0.7 else f"{aa[:-1]}{aa[0]}")
+        rows.append((gene, '+'.join(members), 'Yes', 'synthetic'))
+
+    pd.DataFrame(rows, columns=['Gene', 'AminoAcid', 'Combination', 'Reason_for_Inclusion']).to_csv(path, index=False)
+
+# Function to run a measurement in fresh processes so each peak RSS is its own; keeps the fastest run
+def measure(repeat, target, *target_args):
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(max(1, repeat)):
+        with context.Pool(1) as pool:
+            runs.append(pool.apply(target, target_args))
+    return min(runs, key=lambda run: run['seconds'])
+
+def bench_process_file(tsv_path, mutations_csv, output_prefix, chunk_size):
+    from mutation_screen import FILTER_COLUMN, load_curated_mutations, process_file
+    curated = load_curated_mutations(mutations_csv)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    process_file(tsv_path, output_prefix, *curated, chunk_size=chunk_size or None, filter_column=FILTER_COLUMN)
+    return {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb(), 'baseline_rss_mb': baseline}
+
+def bench_frequency_table(tsv_path, mutations_csv, output_prefix):
+    from mutation_screen import FILTER_COLUMN, load_curated_mutations, read_nextclade_tsv, screen_mutations, create_frequency_table
+    curated = load_curated_mutations(mutations_csv)
+    _, screen_result = screen_mutations(read_nextclade_tsv(tsv_path, filter_column=FILTER_COLUMN), *curated)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    create_frequency_table(screen_result, output_prefix)
+    return {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb(), 'baseline_rss_mb': baseline}
+
+def bench_combiner(results_dir, output_dir, chunk_size):
+    from combine_csv_outputs import combine_files
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    combine_files(results_dir, output_dir, chunk_size or None)
+    return {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb(), 'baseline_rss_mb': baseline}
+
+# Function to describe the code and machine the results were measured on
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BIN_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def result_key(result):
+    return (result['benchmark'], result['dataset'], result['sequences'])
+
+# Function to print the change against earlier results and return the benchmarks that slowed down
+def compare_results(results, baseline_file, tolerance):
+    with open(baseline_file) as handle:
+        baseline = {result_key(result): result for result in json.load(handle)['results']}
+
+    regressions = []
+    print(f"\n{'benchmark':<18} {'dataset':<18} {'sequences':>10} {'before s':>10} {'after s':>10} {'change':>8}")
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        change = result['seconds'] / before['seconds'] - 1 if before['seconds'] else 0.0
+        print(f"{result['benchmark']:<18} {result['dataset']:<18} {result['sequences']:>10} {before['seconds']:>10.3f} {result['seconds']:>10.3f} {change:>+8.1%}")
+        if change > tolerance:
+            regressions.append(result)
+    return regressions
+
+def main():
+    args = parse_arguments()
+    rng = np.random.default_rng(args.seed)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    datasets = args.datasets.split(',') if args.datasets else sorted(os.listdir(DATASETS_DIR))
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix='nf_mutscan_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    try:
+        for n_sequences in sizes:
+            size_dir = os.path.join(work_dir, str(n_sequences))
+            tsv_dir = os.path.join(size_dir, 'nextclade_outputs')
+            mutations_dir = os.path.join(size_dir, 'mutations')
+            results_dir = os.path.join(size_dir, 'mutation_results')
+            for directory in (tsv_dir, mutations_dir, results_dir):
+                os.makedirs(directory, exist_ok=True)
+
+            for dataset_name in datasets:
+                gene, protein = load_reference_protein(os.path.join(DATASETS_DIR, dataset_name))
+                tsv_path = os.path.join(tsv_dir, f"{dataset_name}.tsv")
+                mutations_csv = os.path.join(mutations_dir, f"{dataset_name}_mutations.csv")
+                sites, weights = generate_nextclade_tsv(tsv_path, gene, protein, n_sequences, args, rng)
+                generate_mutation_list(mutations_csv, gene, protein, sites, weights, args, rng)
+
+                for benchmark, target, target_args in [
+                    ('process_file', bench_process_file, (tsv_path, mutations_csv, os.path.join(results_dir, dataset_name), args.chunk_size)),
+                    ('frequency_table', bench_frequency_table, (tsv_path, mutations_csv, os.path.join(size_dir, f"{dataset_name}_frequency"))),
+                ]:
+                    results.append({'benchmark': benchmark, 'dataset': dataset_name, 'sequences': n_sequences, **measure(args.repeat, target, *target_args)})
+                    print(f"{benchmark:<18} {dataset_name:<18} {n_sequences:>10} {results[-1]['seconds']:>8.3f} s {results[-1]['peak_rss_mb']:>8.1f} MB")
+
+            results.append({
+                'benchmark': 'combiner', 'dataset': 'all', 'sequences': n_sequences * len(datasets),
+                **measure(args.repeat, bench_combiner, results_dir, os.path.join(size_dir, 'combined_results'), args.chunk_size)
+            })
+            print(f"{'combiner':<18} {'all':<18} {n_sequences * len(datasets):>10} {results[-1]['seconds']:>8.3f} s {results[-1]['peak_rss_mb']:>8.1f} MB")
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for result in results:
+        result['sequences_per_second'] = round(result['sequences'] / result['seconds']) if result['seconds'] else None
+        result['seconds'] = round(result['seconds'], 4)
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'tolerance', 'keep')}
+    with open(args.output, 'w') as handle:
+        json.dump({'environment': environment(), 'parameters': parameters, 'results': results}, handle, indent=2)
+        handle.write('\n')
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"ERROR: {len(regressions)} benchmarks are more than {args.tolerance:.0%} slower than {args.compare}.", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import hashlib
+
+# Version of the manifest layout; manifests of another version are ignored
+MANIFEST_VERSION = 1
+
+# Function to add the content of one file to a digest
+def update_digest(digest, file_path):
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+
+# Function to hash a file, or every file of a directory (by name and content)
+def path_digest(path):
+    if not path:
+        return None
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, name)):
+                digest.update(name.encode())
+                update_digest(digest, os.path.join(path, name))
+    else:
+        update_digest(digest, path)
+    return digest.hexdigest()
+
+# Function to combine input digests and options into one fingerprint
+def fingerprint(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+class Manifest:
+    """
+    JSON record of completed work, so reruns can skip what is up to date.
+
+    Each entry is keyed by a unit of work (e.g. a dataset) and stores the
+    fingerprint of its inputs and the output files it produced, plus any
+    extra details. An entry is current when its fingerprint matches and all
+    its outputs still exist. The file is rewritten atomically after every
+    record(), so work finished before a failure is kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as handle:
+                    manifest = json.load(handle)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    self.entries = manifest.get('entries', {})
+            except (OSError, ValueError) as e:
+                print(f"Warning: Ignoring unreadable manifest {path}: {e}")
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def is_current(self, key, inputs_fingerprint):
+        entry = self.entries.get(key)
+        return (
+            entry is not None and entry['fingerprint'] == inputs_fingerprint
+            and all(os.path.exists(output) for output in entry['outputs'])
+        )
+
+    def record(self, key, inputs_fingerprint, outputs, **details):
+        self.entries[key] = {
+            'fingerprint': inputs_fingerprint,
+            'outputs': list(outputs),
+            'completed': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            **details,
+        }
+        self.save()
+
+    def discard(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.save()
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as handle:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, handle, indent=2)
+            handle.write('\n')
+        os.replace(temporary, self.path)
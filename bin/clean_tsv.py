@@ -1,43 +1,105 @@
 #!/usr/bin/env python3
 
-import sys
 import os
+import argparse
 import pandas as pd
+from table_io import INTERMEDIATE_FORMATS, TableWriter, table_path
+from instrumentation import Metrics, add_metrics_arguments
+
+# Column that is only populated for sequences Nextclade analysed successfully
+FILTER_COLUMN = 'qc.overallScore'
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Remove empty and failed records from Nextclade TSV files.')
+    parser.add_argument('input_dir', help='Directory containing Nextclade TSV files.')
+    parser.add_argument('output_dir', help='Directory to write the cleaned TSV files to.')
+    parser.add_argument('-f', '--filter_column', default=FILTER_COLUMN, help=f'Drop records where this column is empty (default: {FILTER_COLUMN}; falls back to the 4th column if absent).')
+    parser.add_argument('-c', '--chunk_size', type=int, default=None, help='Stream each TSV in chunks of this many rows to keep memory flat (default: read the whole file).')
+    parser.add_argument('--output_format', choices=INTERMEDIATE_FORMATS, default='csv', help="Write cleaned tables as TSV ('csv', default) or Parquet.")
+    add_metrics_arguments(parser)
+    return parser.parse_args()
+
+# Function to pick the column used to detect failed records
+def resolve_filter_column(columns, filter_column=FILTER_COLUMN):
+    if filter_column in columns:
+        return filter_column
+    # Older layouts: pandas uses zero-based indexing, so column index 3 is the 4th column
+    return columns[3]
+
+# Function to drop records without a value in the filter column and fully empty rows
+def clean_dataframe(df, filter_column=FILTER_COLUMN):
+    # Filter rows where the filter column is not empty
+    column = df[resolve_filter_column(list(df.columns), filter_column)]
+    df = df[column.notna() & (column != '')]
+
+    # Remove any completely empty rows (if any)
+    return df.dropna(how='all')
+
+def clean_tsv_file(input_file, output_file, chunk_size=None, filter_column=FILTER_COLUMN, metrics=None):
+    if metrics is None:
+        metrics = Metrics('clean_tsv')
+    if chunk_size:
+        clean_tsv_file_chunked(input_file, output_file, chunk_size, filter_column, metrics)
+        return
 
-def clean_tsv_file(input_file, output_file):
     # Read the TSV file using pandas
-    df = pd.read_csv(input_file, sep='\t', dtype=str)
+    with metrics.phase('read'):
+        df = pd.read_csv(input_file, sep='\t', dtype=str)
+    metrics.count('rows_in', len(df))
 
     # Check if the DataFrame is empty
     if df.empty:
         print(f"Warning: {input_file} is empty.")
         return
 
-    # Filter rows where the 4th column is not empty
-    # pandas uses zero-based indexing, so column index 3 is the 4th column
-    df = df[df.iloc[:, 3].notna() & (df.iloc[:, 3] != '')]
+    with metrics.phase('clean'):
+        df = clean_dataframe(df, filter_column)
 
-    # Remove any completely empty rows (if any)
-    df.dropna(how='all', inplace=True)
+    # Write the cleaned DataFrame back to a TSV (or Parquet) file
+    with metrics.phase('write'), TableWriter(output_file, sep='\t') as writer:
+        writer.write(df)
+    metrics.count('rows_out', writer.rows)
+
+    print(f"Cleaned {input_file}, saved to {output_file}")
 
-    # Write the cleaned DataFrame back to a TSV file
-    df.to_csv(output_file, sep='\t', index=False)
+def clean_tsv_file_chunked(input_file, output_file, chunk_size, filter_column=FILTER_COLUMN, metrics=None):
+    """
+    Clean a TSV in fixed-size chunks, appending each cleaned chunk to the
+    output so only one chunk is held in memory at a time.
+    """
+    if metrics is None:
+        metrics = Metrics('clean_tsv')
+    with TableWriter(output_file, sep='\t') as writer:
+        for chunk in metrics.timed('read', pd.read_csv(input_file, sep='\t', dtype=str, chunksize=chunk_size)):
+            metrics.count('rows_in', len(chunk))
+            # A header-only input yields one empty chunk; write nothing for it, as the whole-file path does
+            if chunk.empty:
+                continue
+            with metrics.phase('clean'):
+                chunk = clean_dataframe(chunk, filter_column)
+            with metrics.phase('write'):
+                writer.write(chunk)
+    metrics.count('rows_out', writer.rows)
+
+    if not writer.chunks:
+        print(f"Warning: {input_file} is empty.")
+        return
 
     print(f"Cleaned {input_file}, saved to {output_file}")
 
-def main(input_dir, output_dir):
+def main(input_dir, output_dir, chunk_size=None, filter_column=FILTER_COLUMN, output_format='csv', metrics=None):
+    if metrics is None:
+        metrics = Metrics('clean_tsv')
     os.makedirs(output_dir, exist_ok=True)
     for filename in os.listdir(input_dir):
         if filename.endswith('.tsv'):
             input_file = os.path.join(input_dir, filename)
-            output_filename = f"{os.path.splitext(filename)[0]}_cleaned.tsv"
-            output_file = os.path.join(output_dir, output_filename)
-            clean_tsv_file(input_file, output_file)
+            output_file = table_path(os.path.join(output_dir, f"{os.path.splitext(filename)[0]}_cleaned"), output_format, sep='\t')
+            file_metrics = Metrics(filename)
+            clean_tsv_file(input_file, output_file, chunk_size, filter_column, file_metrics)
+            metrics.add_dataset(filename, file_metrics.to_dict())
+    metrics.write()
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: clean_tsv.py <input_dir> <output_dir>")
-        sys.exit(1)
-    input_dir = sys.argv[1]
-    output_dir = sys.argv[2]
-    main(input_dir, output_dir)
+    args = parse_arguments()
+    main(args.input_dir, args.output_dir, args.chunk_size, args.filter_column, args.output_format, Metrics('clean_tsv', args.metrics, args.profile))
@@ -1,102 +1,188 @@
 #!/usr/bin/env python3
 
+import io
 import os
-import pandas as pd
+import gzip
 import argparse
+from contextlib import contextmanager
+from table_io import read_table, strip_table_suffix
+from checkpoint import Manifest, fingerprint, path_digest
+from instrumentation import Metrics, add_metrics_arguments
+
+# Manifest of the combined outputs kept in the output directory with --resume
+COMBINE_MANIFEST = 'combine_manifest.json'
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Combine and split processed mutation analysis CSV files.')
     parser.add_argument('-i', '--input_dir', required=True, help='Directory containing the mutation analysis CSV files.')
     parser.add_argument('-o', '--output_dir', required=True, help='Directory to save the separated output CSV files.')
+    parser.add_argument('-c', '--chunk_size', type=int, default=100000, help='Rows read from each input at a time (default: 100000; 0 reads each file whole).')
+    parser.add_argument('-z', '--compress', action='store_true', help='Write gzip-compressed Mutation_List.csv.gz and Mutation_Counts.csv.gz.')
+    parser.add_argument('--resume', action='store_true', help=f'Record input hashes in {COMBINE_MANIFEST}; on reruns copy the sections of unchanged inputs from the previous outputs and only re-read changed ones.')
+    add_metrics_arguments(parser)
     return parser.parse_args()
 
-def process_csv_files(input_dir):
-    mutation_list_data = []
-    count_data = []
-    
-    # Collect all the mutation summary CSV files (excluding freq_summary files)
-    mutation_summary_files = [
+# Columns written to Mutation_List.csv and Mutation_Counts.csv
+MUTATION_LIST_COLUMNS = [
+    'Sequence_ID', 'All_Mutations', 'Curated_Mutations', 'Inferred_Mutations',
+    'Combination_Present', 'Mutation_List'
+]
+COUNT_COLUMNS = ['Mutation_List', 'Mutation/Combination', 'Count', 'Type', 'Frequency']
+
+def find_result_files(input_dir):
+    # Collect all the mutation summary CSV/Parquet files (excluding freq_summary files)
+    mutation_summary_files = sorted(
         f for f in os.listdir(input_dir)
-        if f.endswith('_summary.csv') and not f.endswith('_freq_summary.csv')
-    ]
-    
-    # Collect all the frequency summary CSV files
-    freq_summary_files = [f for f in os.listdir(input_dir) if f.endswith('_freq_summary.csv')]
-    
+        if strip_table_suffix(f, '_summary') is not None and strip_table_suffix(f, '_freq_summary') is None
+    )
+
+    # Collect all the frequency summary CSV/Parquet files
+    freq_summary_files = sorted(f for f in os.listdir(input_dir) if strip_table_suffix(f, '_freq_summary') is not None)
+
     if not mutation_summary_files:
         raise FileNotFoundError(f"No mutation '_summary.csv' files found in {input_dir}")
-    
+
     if not freq_summary_files:
         raise FileNotFoundError(f"No '_freq_summary.csv' files found in {input_dir}")
-    
-    # Process mutation summary files for Mutation_List.csv
-    for csv_file in mutation_summary_files:
-        # Correctly extract the mutation list name
-        mutation_list_name = os.path.basename(csv_file).split('_summary.csv')[0]
-        file_path = os.path.join(input_dir, csv_file)
-        
-        # Read the CSV file
-        df = pd.read_csv(file_path, skip_blank_lines=True)
-        
-        # Add the 'Mutation_List' column
-        df['Mutation_List'] = mutation_list_name
-        
-        # Define columns for mutation list
-        mutation_list_columns = [
-            'Sequence_ID', 'All_Mutations', 'Curated_Mutations', 'Inferred_Mutations',
-            'Combination_Present', 'Mutation_List'
-        ]
-        
-        # Select the relevant columns
-        mutation_list_df = df[mutation_list_columns]
-        mutation_list_data.append(mutation_list_df)
-    
-    # Process frequency summary files for Mutation_Counts.csv
-    for csv_file in freq_summary_files:
+
+    return mutation_summary_files, freq_summary_files
+
+# Function to write one section of a combined output as text, as its own gzip member if compressed
+@contextmanager
+def open_section(raw, compress=False):
+    """
+    Sections are byte ranges of the output file, so a later run can copy an
+    unchanged section verbatim; concatenated gzip members form a valid
+    gzip file.
+    """
+    stream = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+    handle = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    try:
+        yield handle
+    finally:
+        handle.flush()
+        handle.detach()
+        if compress:
+            stream.close()
+
+# Function to copy length bytes from one open file to another
+def copy_bytes(source, target, length):
+    while length > 0:
+        block = source.read(min(length, 1 << 20))
+        if not block:
+            raise ValueError("ERROR: Previous combined output is shorter than its manifest records.")
+        target.write(block)
+        length -= len(block)
+
+# Function to write one combined output, one section per input file
+def write_combined(output_file, input_dir, files, suffix, columns, chunk_size=None, compress=False, digests=None, reusable=None):
+    """
+    Sections listed in reusable (input file -> section of the previous
+    output) are copied from the existing output_file instead of re-read.
+    The output is written to a temporary file and moved into place.
+    Returns (sections, rows, sections reused).
+    """
+    digests = digests or {}
+    reusable = reusable or {}
+    sections = []
+    rows = 0
+    temporary = f"{output_file}.tmp"
+    with open(temporary, 'wb') as raw, open(output_file if reusable else os.devnull, 'rb') as previous:
+        with open_section(raw, compress) as handle:
+            handle.write(','.join(columns) + '\n')
+        for table_file in files:
+            start = raw.tell()
+            if table_file in reusable:
+                section = reusable[table_file]
+                previous.seek(section['offset'])
+                copy_bytes(previous, raw, section['length'])
+                section_rows = section['rows']
+            else:
+                with open_section(raw, compress) as handle:
+                    section_rows = append_tables(input_dir, [table_file], suffix, columns, handle, chunk_size)
+            sections.append({
+                'input': table_file, 'digest': digests.get(table_file), 'offset': start, 'length': raw.tell() - start, 'rows': section_rows
+            })
+            rows += section_rows
+    os.replace(temporary, output_file)
+    return sections, rows, sum(1 for table_file in files if table_file in reusable)
+
+# Function to append the selected columns of every input file to one open output, a chunk at a time
+def append_tables(input_dir, files, suffix, columns, handle, chunk_size=None):
+    """
+    Each chunk is annotated with the Mutation_List column (the file name
+    without suffix), reduced to columns and written straight to handle, so
+    only one chunk is held in memory. Returns the number of rows written.
+    """
+    rows = 0
+    for table_file in files:
         # Correctly extract the mutation list name
-        mutation_list_name = os.path.basename(csv_file).split('_freq_summary.csv')[0]
-        file_path = os.path.join(input_dir, csv_file)
-        
-        # Read the CSV file
-        df = pd.read_csv(file_path, skip_blank_lines=True)
-        
-        # Add the 'Mutation_List' column
-        df['Mutation_List'] = mutation_list_name
-        
-        # Define columns for counts
-        count_columns = ['Mutation_List', 'Mutation/Combination', 'Count', 'Type', 'Frequency']
-        
-        # Select the relevant columns
-        count_df = df[count_columns]
-        count_data.append(count_df)
-    
-    # Concatenate all the dataframes into single ones
-    mutation_list_combined_df = pd.concat(mutation_list_data, ignore_index=True)
-    count_combined_df = pd.concat(count_data, ignore_index=True)
-    
-    return mutation_list_combined_df, count_combined_df
+        mutation_list_name = strip_table_suffix(table_file, suffix)
+        file_path = os.path.join(input_dir, table_file)
+
+        # Read the CSV (or Parquet) file
+        input_columns = [column for column in columns if column != 'Mutation_List']
+        chunks = read_table(file_path, columns=input_columns, chunk_size=chunk_size, skip_blank_lines=True)
+        for df in ([chunks] if not chunk_size else chunks):
+            # Add the 'Mutation_List' column and select the relevant columns
+            df['Mutation_List'] = mutation_list_name
+            df[columns].to_csv(handle, index=False, header=False)
+            rows += len(df)
+    return rows
 
-def save_separated_files(mutation_list_df, count_df, output_dir):
+def combine_files(input_dir, output_dir, chunk_size=None, compress=False, metrics=None, resume=False):
+    """
+    With resume, the input hashes and the byte range each input occupies in
+    the outputs are kept in COMBINE_MANIFEST. A rerun skips an output whose
+    inputs are all unchanged and otherwise re-reads only new or changed
+    inputs, copying the other sections from the previous output.
+    """
+    if metrics is None:
+        metrics = Metrics('combine_csv_outputs')
+    mutation_summary_files, freq_summary_files = find_result_files(input_dir)
+    metrics.count('files_in', len(mutation_summary_files) + len(freq_summary_files))
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Save the separate CSV files
-    mutation_list_file = os.path.join(output_dir, 'Mutation_List.csv')
-    count_file = os.path.join(output_dir, 'Mutation_Counts.csv')
-    
-    mutation_list_df.to_csv(mutation_list_file, index=False)
-    count_df.to_csv(count_file, index=False)
-    
-    print(f"Mutation List saved to: {mutation_list_file}")
-    print(f"Mutation Counts saved to: {count_file}")
+    manifest = Manifest(os.path.join(output_dir, COMBINE_MANIFEST)) if resume else None
+
+    # Write Mutation_List.csv and Mutation_Counts.csv one input chunk at a time
+    for output_name, files, suffix, columns in [
+        ('Mutation_List.csv', mutation_summary_files, '_summary', MUTATION_LIST_COLUMNS),
+        ('Mutation_Counts.csv', freq_summary_files, '_freq_summary', COUNT_COLUMNS),
+    ]:
+        output_file = os.path.join(output_dir, output_name) + ('.gz' if compress else '')
+        digests = {}
+        reusable = {}
+        if manifest is not None:
+            with metrics.phase('hash_inputs'):
+                digests = {table_file: path_digest(os.path.join(input_dir, table_file)) for table_file in files}
+            inputs_fingerprint = fingerprint({'inputs': digests, 'columns': columns, 'compress': compress})
+            if manifest.is_current(output_name, inputs_fingerprint):
+                rows = sum(section['rows'] for section in manifest.get(output_name)['sections'])
+                metrics.count('outputs_skipped')
+                metrics.count(f"{output_name[:-4].lower()}_rows", rows)
+                print(f"{output_name[:-4].replace('_', ' ')} is up to date: {output_file} ({rows} rows)")
+                continue
+
+            # Sections of unchanged inputs can be copied from the previous output
+            previous = manifest.get(output_name)
+            if previous and previous.get('columns') == columns and previous.get('compress') == compress and os.path.exists(output_file):
+                reusable = {section['input']: section for section in previous['sections'] if digests.get(section['input']) == section['digest']}
+
+        with metrics.phase(output_name):
+            sections, rows, n_reused = write_combined(output_file, input_dir, files, suffix, columns, chunk_size, compress, digests, reusable)
+        if manifest is not None:
+            manifest.record(output_name, inputs_fingerprint, [output_file], columns=columns, compress=compress, sections=sections)
+            metrics.count('sections_reused', n_reused)
+        metrics.count(f"{output_name[:-4].lower()}_rows", rows)
+        print(f"{output_name[:-4].replace('_', ' ')} saved to: {output_file} ({rows} rows{f', {n_reused} of {len(files)} inputs unchanged' if n_reused else ''})")
 
 def main():
     args = parse_arguments()
     
-    # Process CSV files to get mutation list and counts DataFrames
-    mutation_list_df, count_df = process_csv_files(args.input_dir)
-    
-    # Save the separated files
-    save_separated_files(mutation_list_df, count_df, args.output_dir)
+    # Stream the summary and frequency tables into the combined files
+    metrics = Metrics('combine_csv_outputs', args.metrics, args.profile)
+    combine_files(args.input_dir, args.output_dir, args.chunk_size or None, args.compress, metrics, args.resume)
+    metrics.write()
 
 if __name__ == '__main__':
     main()
@@ -1,14 +1,29 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
 import os
 import shutil
 import sys
+from instrumentation import Metrics, add_metrics_arguments
+
+FASTA_EXTENSIONS = ('.fasta', '.fa', '.consensus.fasta', '.irma.fasta', '.irma.consensus.fasta')
+
+# Nucleotide IUPAC codes (plus gaps) accepted by Nextclade
+VALID_RESIDUES = frozenset('ACGTURYSWKMBDHVN-.')
+
+# Number of record-level problems printed before the rest are summarized
+MAX_REPORTED_ERRORS = 20
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Prepare FASTA files for processing.')
     parser.add_argument('-i', '--input_dir', required=True, help='Input directory containing FASTA files.')
     parser.add_argument('-o', '--output_dir', required=True, help='Output directory for processed files.')
+    parser.add_argument('-n', '--output_name', default='sequences.fasta', help='Name of the concatenated FASTA file (default: sequences.fasta).')
+    parser.add_argument('-d', '--dedup', action='store_true', help='Write each distinct sequence once and record the other IDs that share it in the sequence map.')
+    parser.add_argument('--sequence_map', default='sequence_map.tsv', help='Name of the TSV mapping collapsed sequence IDs to their representative (default: sequence_map.tsv).')
+    parser.add_argument('--link', action='store_true', help='Keep one FASTA per input file, hardlinking files that need no changes instead of concatenating them.')
+    add_metrics_arguments(parser)
     return parser.parse_args()
 
 def log_error(message):
@@ -19,51 +34,205 @@ def validate_input_dir(input_dir):
     # Check if input directory exists
     if not os.path.exists(input_dir):
         log_error(f"ERROR: Input directory '{input_dir}' does not exist.")
-    
+
     # Check if directory contains FASTA files
-    fasta_files = [f for f in os.listdir(input_dir) if f.endswith(('.fasta', '.fa', '.consensus.fasta', '.irma.fasta', '.irma.consensus.fasta'))]
+    fasta_files = sorted(f for f in os.listdir(input_dir) if f.endswith(FASTA_EXTENSIONS))
     if not fasta_files:
         log_error(f"ERROR: No FASTA files found in the input directory '{input_dir}'.")
-    
+
     # Check if FASTA files are empty
     empty_files = [f for f in fasta_files if os.path.getsize(os.path.join(input_dir, f)) == 0]
     if empty_files:
         log_error(f"ERROR: The following FASTA files in '{input_dir}' are empty: {', '.join(empty_files)}")
 
-def copy_fasta_files(input_dir, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
-    for file in os.listdir(input_dir):
-        if file.endswith(('.fasta', '.fa', '.consensus.fasta', '.irma.fasta', '.irma.consensus.fasta')):
-            src = os.path.join(input_dir, file)
-            dst = os.path.join(output_dir, file)
-            shutil.copy(src, dst)
+    return [os.path.join(input_dir, f) for f in fasta_files]
 
-def rename_files_to_fasta(directory):
+# Function to give every FASTA file a consistent .fasta extension
+def normalize_file_name(file):
     valid_extensions = ['consensus.fasta', 'irma.fasta', 'fa', 'fasta', 'irma.consensus.fasta']
-    new_extension = 'fasta'
-    for file in os.listdir(directory):
-        for ext in valid_extensions:
-            if file.endswith(f".{ext}"):
-                base = file.rsplit(f".{ext}", 1)[0]
-                new_filename = f"{base}.{new_extension}"
-                os.rename(os.path.join(directory, file), os.path.join(directory, new_filename))
-                break  # Move to the next file after renaming
+    for ext in valid_extensions:
+        if file.endswith(f".{ext}"):
+            base = file.rsplit(f".{ext}", 1)[0]
+            return f"{base}.fasta"
+    return file
+
+# Function to stream FASTA records as (header line number, name, sequence lines) one record at a time
+def read_fasta_records(fasta_file, errors):
+    """
+    Header names and sequence lines are stripped of surrounding whitespace and
+    blank lines are skipped. Structural problems are appended to errors.
+    """
+    name = None
+    start = 0
+    lines = []
+    with open(fasta_file) as handle:
+        for line_number, line in enumerate(handle, 1):
+            line = line.strip()
+            if line.startswith('>'):
+                if name is not None:
+                    yield start, name, lines
+                name = line[1:].strip()
+                start = line_number
+                lines = []
+                if not name:
+                    errors.append(f"{fasta_file}:{line_number}: header has no sequence name")
+            elif not line:
+                continue
+            elif name is None:
+                errors.append(f"{fasta_file}:{line_number}: sequence data before the first header")
+            else:
+                lines.append(line)
+    if name is not None:
+        yield start, name, lines
+
+# Function to check that a record has a sequence made only of nucleotide codes
+def validate_record(fasta_file, line_number, name, lines, errors):
+    if not lines:
+        errors.append(f"{fasta_file}:{line_number}: record '{name}' has no sequence")
+        return
+    invalid = set(''.join(lines).upper()) - VALID_RESIDUES
+    if invalid:
+        errors.append(f"{fasta_file}:{line_number}: record '{name}' contains invalid characters: {''.join(sorted(invalid))}")
+
+# Function to validate every record and find sequence IDs repeated across the input files
+def scan_records(fasta_files, errors):
+    """
+    Yields (fasta_file, line_number, name, lines, digest, keep) for every
+    record, where digest is the SHA-256 of the upper-cased sequence.
+    A repeated ID with the same sequence is kept once (keep=False for the
+    repeats); a repeated ID with a different sequence is an error.
+    """
+    seen = {}
+    for fasta_file in fasta_files:
+        n_records = 0
+        for line_number, name, lines in read_fasta_records(fasta_file, errors):
+            n_records += 1
+            validate_record(fasta_file, line_number, name, lines, errors)
+            digest = hashlib.sha256(''.join(lines).upper().encode()).digest()
+            if name in seen:
+                first_file, first_line, first_digest = seen[name]
+                if digest != first_digest:
+                    errors.append(f"{fasta_file}:{line_number}: sequence ID '{name}' already used with a different sequence at {first_file}:{first_line}")
+                else:
+                    print(f"Warning: Dropping duplicate of '{name}' at {fasta_file}:{line_number} (same sequence as {first_file}:{first_line})")
+                yield fasta_file, line_number, name, lines, digest, False
+                continue
+            seen[name] = (fasta_file, line_number, digest)
+            yield fasta_file, line_number, name, lines, digest, True
+        if n_records == 0:
+            errors.append(f"{fasta_file}: no FASTA records found")
+
+def write_record(handle, name, lines):
+    handle.write(f">{name}\n")
+    for line in lines:
+        handle.write(f"{line}\n")
+
+# Function to write all valid, unique records to one FASTA file in a single pass
+def concatenate_fasta_files(fasta_files, output_file, errors, map_file=None, dedup=False):
+    """
+    With dedup, a record whose sequence was already written is not written
+    again; its ID is recorded in map_file (seqName, representative) instead.
+    Returns (records written, repeated IDs dropped, IDs collapsed by dedup).
+    """
+    n_written = 0
+    n_dropped = 0
+    n_collapsed = 0
+    representatives = {}
+    with open(output_file, 'w') as handle, open(map_file or os.devnull, 'w') as map_handle:
+        map_handle.write("seqName\trepresentative\n")
+        for _, _, name, lines, digest, keep in scan_records(fasta_files, errors):
+            if not keep:
+                n_dropped += 1
+                continue
+            if dedup:
+                representative = representatives.setdefault(digest, name)
+                if representative != name:
+                    map_handle.write(f"{name}\t{representative}\n")
+                    n_collapsed += 1
+                    continue
+            write_record(handle, name, lines)
+            n_written += 1
+    return n_written, n_dropped, n_collapsed
+
+# Function to place one FASTA per input file, hardlinking files that need no changes
+def link_fasta_files(fasta_files, output_dir, errors):
+    dropped = {}
+    for fasta_file, line_number, _, _, _, keep in scan_records(fasta_files, errors):
+        if not keep:
+            dropped.setdefault(fasta_file, set()).add(line_number)
+    if errors:
+        return
+
+    targets = {}
+    for fasta_file in fasta_files:
+        target = os.path.join(output_dir, normalize_file_name(os.path.basename(fasta_file)))
+        if target in targets:
+            errors.append(f"{fasta_file}: output name '{os.path.basename(target)}' already used by {targets[target]}")
+            return
+        targets[target] = fasta_file
+
+    for target, fasta_file in targets.items():
+        if os.path.exists(target):
+            os.remove(target)
+        if fasta_file in dropped:
+            # Rewrite files that contained duplicate records without them
+            with open(target, 'w') as handle:
+                for line_number, name, lines in read_fasta_records(fasta_file, []):
+                    if line_number not in dropped[fasta_file]:
+                        write_record(handle, name, lines)
+            continue
+        try:
+            os.link(fasta_file, target)
+        except OSError:
+            # Different filesystem or no hardlink support
+            shutil.copy(fasta_file, target)
+
+def report_errors(errors):
+    for error in errors[:MAX_REPORTED_ERRORS]:
+        print(f"ERROR: {error}", file=sys.stderr)
+    if len(errors) > MAX_REPORTED_ERRORS:
+        print(f"ERROR: ... and {len(errors) - MAX_REPORTED_ERRORS} more problems", file=sys.stderr)
+    log_error(f"ERROR: Input FASTA validation failed with {len(errors)} problems.")
 
 def main():
     args = parse_arguments()
     input_dir = args.input_dir
     output_dir = args.output_dir
+    metrics = Metrics('data_preparation', args.metrics, args.profile)
 
     # Validate input directory
     print(f"Validating input directory: {input_dir}")
-    validate_input_dir(input_dir)
+    with metrics.phase('validate_input_dir'):
+        fasta_files = validate_input_dir(input_dir)
+    metrics.count('files_in', len(fasta_files))
 
     # Process files
-    print(f"Copying FASTA files from {input_dir} to {output_dir}")
-    copy_fasta_files(input_dir, output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    errors = []
+    if args.link:
+        print(f"Validating {len(fasta_files)} FASTA files and linking them into {output_dir}")
+        with metrics.phase('link'):
+            link_fasta_files(fasta_files, output_dir, errors)
+    else:
+        output_file = os.path.join(output_dir, args.output_name)
+        print(f"Validating {len(fasta_files)} FASTA files and concatenating them into {output_file}")
+        map_file = os.path.join(output_dir, args.sequence_map)
+        with metrics.phase('concatenate'):
+            n_written, n_dropped, n_collapsed = concatenate_fasta_files(fasta_files, output_file, errors, map_file, args.dedup)
+        metrics.count('records_in', n_written + n_dropped + n_collapsed)
+        metrics.count('records_out', n_written)
+        metrics.count('duplicates_dropped', n_dropped)
+        metrics.count('sequences_collapsed', n_collapsed)
+        if errors:
+            os.remove(output_file)
+            os.remove(map_file)
+        else:
+            print(f"Wrote {n_written} records ({n_dropped} duplicates dropped, {n_collapsed} identical sequences collapsed into {map_file})")
 
-    print(f"Renaming files in {output_dir} to have consistent .fasta extensions")
-    rename_files_to_fasta(output_dir)
+    metrics.count('errors', len(errors))
+    metrics.write()
+    if errors:
+        report_errors(errors)
 
     print("Data preparation completed successfully.")
 
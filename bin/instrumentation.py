@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager
+
+# Function to report the peak resident set size of this process (or of its finished children) in MB
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+class Metrics:
+    """
+    Per-task timing and counters, written as one JSON file.
+
+    phase() times a named step; repeated phases with the same name (e.g. one
+    per chunk) are added together. Each phase also records the process peak
+    RSS seen when it last finished, a high-water mark rather than the
+    phase's own usage. count() adds to task-level counters such as rows_in,
+    rows_out or mutations matched. Metrics of individual datasets, e.g.
+    from worker processes, are attached with add_dataset(). With
+    profile_file, the task runs under cProfile and the stats are dumped on
+    write().
+    """
+
+    def __init__(self, task, metrics_file=None, profile_file=None):
+        self.task = task
+        self.metrics_file = metrics_file
+        self.profile_file = profile_file
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.datasets = {}
+        self._profiler = None
+        if profile_file:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self.phases.setdefault(name, {'wall_seconds': 0.0, 'calls': 0})
+            record['wall_seconds'] += time.perf_counter() - start
+            record['calls'] += 1
+            record['peak_rss_mb'] = peak_rss_mb()
+
+    # Function to time each step of an iterator (e.g. reading the next chunk) as a phase
+    def timed(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    # Function to attach the metrics dict of one dataset (or file) and add its counters to the task totals
+    def add_dataset(self, name, metrics):
+        self.datasets[name] = metrics
+        for counter, value in metrics.get('counters', {}).items():
+            self.count(counter, value)
+
+    def to_dict(self):
+        metrics = {
+            'task': self.task,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'wall_seconds': round(time.perf_counter() - self._start, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_children_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'counters': self.counters,
+            'phases': {name: {**record, 'wall_seconds': round(record['wall_seconds'], 3)} for name, record in self.phases.items()},
+        }
+        if self.datasets:
+            metrics['datasets'] = self.datasets
+        return metrics
+
+    def write(self):
+        """
+        Write the metrics JSON (if a file was given) and the cProfile stats (if profiling).
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+            os.makedirs(os.path.dirname(os.path.abspath(self.profile_file)), exist_ok=True)
+            self._profiler.dump_stats(self.profile_file)
+            print(f"Profile written to {self.profile_file}")
+        if self.metrics_file:
+            os.makedirs(os.path.dirname(os.path.abspath(self.metrics_file)), exist_ok=True)
+            with open(self.metrics_file, 'w') as handle:
+                json.dump(self.to_dict(), handle, indent=2)
+                handle.write('\n')
+            print(f"Metrics written to {self.metrics_file}")
+
+# Function to add the --metrics and --profile options shared by the bin/ scripts
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', default=None, help='Write per-phase wall time, peak RSS and row/match counts to this JSON file.')
+    parser.add_argument('--profile', default=None, help='Run under cProfile and dump the stats to this file (view with python -m pstats).')
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import pickle
+import shutil
+import hashlib
+import argparse
+import pandas as pd
+from mutation_screen import PANEL_FORMAT_VERSION, PANEL_SUFFIX, load_mutation_panel, parse_curated_mutations
+from validate_mutation_files import validate_mutations_df
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Compile curated mutation lists into panels that mutation_screen.py loads without reparsing.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = subparsers.add_parser('compile', help='Validate mutation list CSVs and write one panel per list.')
+    compile_parser.add_argument('-m', '--mutations', required=True, help='Mutation list CSV, or a directory of them (existing panels in it are checked and copied, unless a CSV of the same name replaces them).')
+    compile_parser.add_argument('-o', '--output', required=True, help='Panel file for a single CSV, or output directory for a directory of lists.')
+
+    info_parser = subparsers.add_parser('info', help='Print the version, ID and contents summary of a panel.')
+    info_parser.add_argument('panel', help=f'Panel file ({PANEL_SUFFIX}).')
+    return parser.parse_args()
+
+# Function to name a mutation list CSV or compiled panel after its file name without extension
+def mutation_list_name(mutation_file):
+    name = os.path.basename(mutation_file)
+    for suffix in (PANEL_SUFFIX, '.csv'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+# Function to drop compiled panels that have a mutation list CSV of the same name
+def drop_shadowed_panels(files):
+    """
+    The CSV is the source a panel is compiled from, so when both are present
+    the panel may be outdated and the CSV is used instead.
+    """
+    csv_names = {mutation_list_name(f) for f in files if f.endswith('.csv')}
+    kept = []
+    for f in files:
+        if f.endswith(PANEL_SUFFIX) and mutation_list_name(f) in csv_names:
+            print(f"Ignoring compiled panel {os.path.basename(f)}: using {mutation_list_name(f)}.csv instead")
+            continue
+        kept.append(f)
+    return kept
+
+# Function to identify a panel by its curated content, independent of CSV formatting
+def panel_id(individual_mutations, combination_mutations):
+    content = json.dumps([individual_mutations, combination_mutations], separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+# Function to validate one mutation list CSV and build its panel
+def compile_panel(mutations_csv):
+    mutations_df = pd.read_csv(mutations_csv, keep_default_na=False)
+    validate_mutations_df(mutations_df, mutations_csv)
+
+    curated_mutations = parse_curated_mutations(mutations_df)
+    individual_mutations, combination_mutations = curated_mutations[:2]
+    return {
+        'format_version': PANEL_FORMAT_VERSION,
+        'panel_id': panel_id(individual_mutations, combination_mutations),
+        'source': os.path.basename(mutations_csv),
+        'curated_mutations': curated_mutations,
+    }
+
+def write_panel(panel, panel_file):
+    with open(panel_file, 'wb') as handle:
+        pickle.dump(panel, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"Compiled {panel['source']} into {panel_file} (panel {panel['panel_id'][:12]})")
+
+# Function to compile every mutation list in a directory, keeping the CSV base names
+def compile_directory(mutations_dir, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    files = drop_shadowed_panels(sorted(os.listdir(mutations_dir)))
+    csv_files = [f for f in files if f.endswith('.csv')]
+    panel_files = [f for f in files if f.endswith(PANEL_SUFFIX)]
+    if not csv_files and not panel_files:
+        raise FileNotFoundError(f"ERROR: No CSV files found in mutation directory '{mutations_dir}'.")
+
+    for file in csv_files:
+        panel_file = os.path.join(output_dir, f"{mutation_list_name(file)}{PANEL_SUFFIX}")
+        write_panel(compile_panel(os.path.join(mutations_dir, file)), panel_file)
+
+    # Panels compiled in an earlier run are reused once their format version is checked
+    for file in panel_files:
+        load_mutation_panel(os.path.join(mutations_dir, file))
+        shutil.copy(os.path.join(mutations_dir, file), os.path.join(output_dir, file))
+        print(f"Reusing compiled panel {file}")
+
+def print_panel_info(panel_file):
+    panel = load_mutation_panel(panel_file)
+    individual_mutations, combination_mutations, (_, wildcard_index), _ = panel['curated_mutations']
+    print(f"Panel:                 {panel_file}")
+    print(f"Format version:        {panel['format_version']}")
+    print(f"Panel ID:              {panel['panel_id']}")
+    print(f"Source:                {panel['source']}")
+    print(f"Individual mutations:  {len(individual_mutations)} ({len(wildcard_index)} wildcard positions)")
+    print(f"Combinations:          {len(combination_mutations)}")
+
+def main():
+    args = parse_arguments()
+    try:
+        if args.command == 'compile':
+            if os.path.isdir(args.mutations):
+                compile_directory(args.mutations, args.output)
+            else:
+                write_panel(compile_panel(args.mutations), args.output)
+        else:
+            print_panel_info(args.panel)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,119 @@
 #!/usr/bin/env python3
 
+import os
+import pickle
 import argparse
+import numpy as np
 import pandas as pd
-from collections import Counter
+from contextlib import ExitStack
+from clean_tsv import FILTER_COLUMN, clean_dataframe, resolve_filter_column
+from table_io import INTERMEDIATE_FORMATS, TableWriter, read_columns, read_table, table_path
+from instrumentation import Metrics, add_metrics_arguments
+
+MUTATION_COLUMNS = ['aaSubstitutions', 'aaDeletions', 'aaInsertions']
+# Compiled mutation panels (see mutation_panel.py compile)
+PANEL_FORMAT_VERSION = 1
+PANEL_SUFFIX = '.panel.pkl'
+SUMMARY_COLUMNS = ['seqName', 'All_Mutations', 'Curated_Mutations', 'Inferred_Mutations', 'Combination_Present']
+# Nextclade columns describing which part of the reference a sequence covers
+COVERAGE_COLUMNS = ['alignmentStart', 'alignmentEnd', 'missing']
+# Annotation file names of Nextclade v3 and v2 datasets
+ANNOTATION_FILES = ['genome_annotation.gff3', 'genemap.gff']
 
 # Function to parse command-line arguments
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Extract mutations from a single TSV file and compare against curated mutations.')
-    parser.add_argument('-i', '--input_file', required=True, help='TSV file containing results from multiple samples.')
-    parser.add_argument('-o', '--output_prefix', default='mutation_summary', help='Prefix for the output CSV file(s).')
-    parser.add_argument('-m', '--mutations_csv', required=False, help='Path to CSV file containing curated mutations in the format: Gene, AminoAcid, Combination, Reason_for_Inclusion.')
+    parser.add_argument('-i', '--input_file', required=True, help='TSV (or cleaned Parquet) file containing results from multiple samples.')
+    parser.add_argument('-o', '--output_prefix', nargs='+', default=['mutation_summary'], help='Prefix for the output CSV file(s); one per mutation list when several are given.')
+    parser.add_argument('-m', '--mutations_csv', nargs='+', required=False, help='Path to CSV file(s) (or compiled panels) containing curated mutations in the format: Gene, AminoAcid, Combination, Reason_for_Inclusion. Several lists are screened in one pass over the TSV.')
+    parser.add_argument('-c', '--chunk_size', type=int, default=None, help='Stream the TSV in chunks of this many rows to keep memory flat (default: read the whole file).')
+    parser.add_argument('--clean', action='store_true', help='Input is raw Nextclade output; drop failed records in-process as clean_tsv.py would.')
+    parser.add_argument('-f', '--filter_column', default=FILTER_COLUMN, help=f'Column used by --clean to detect failed records (default: {FILTER_COLUMN}).')
+    parser.add_argument('--output_format', choices=INTERMEDIATE_FORMATS, default='csv', help="Write the summary and frequency tables as CSV (default) or Parquet.")
+    add_metrics_arguments(parser)
+    parser.add_argument('-s', '--sequence_map', default=None, help='TSV (seqName, representative) of sequences collapsed by data_preparation.py --dedup; their results are copied from the representative.')
+    parser.add_argument('-g', '--gene_map', default=None, help='Nextclade dataset directory or its GFF3 annotation; reference residues are then only inferred at codons the sequence covers.')
     return parser.parse_args()
 
-# Function to load curated mutations from a CSV file
+# Function to load curated mutations from a CSV file or a compiled panel
 def load_curated_mutations(mutations_csv):
+    if mutations_csv.endswith(PANEL_SUFFIX):
+        return load_mutation_panel(mutations_csv)['curated_mutations']
+
     mutations_df = pd.read_csv(mutations_csv, keep_default_na=False)
     if not {'Gene', 'AminoAcid', 'Combination', 'Reason_for_Inclusion'}.issubset(mutations_df.columns):
         raise ValueError("The mutations CSV must contain 'Gene', 'AminoAcid', 'Combination', and 'Reason_for_Inclusion' columns.")
+    return parse_curated_mutations(mutations_df)
 
+# Function to split a curated mutation table into individual mutations and combinations
+def parse_curated_mutations(mutations_df):
     individual_mutations = []
     combination_mutations = {}
-    
-    for _, row in mutations_df.iterrows():
-        if '+' in row['AminoAcid']:  # Combination
-            combination = [f"{row['Gene']}:{mut}" for mut in row['AminoAcid'].split('+')]
-            combination_mutations[row['AminoAcid']] = combination
+
+    for gene, amino_acid in zip(mutations_df['Gene'], mutations_df['AminoAcid']):
+        if '+' in amino_acid:  # Combination
+            combination = [f"{gene}:{mut}" for mut in amino_acid.split('+')]
+            combination_mutations[amino_acid] = combination
         else:
-            mutation_key = f"{row['Gene']}:{row['AminoAcid']}"
+            mutation_key = f"{gene}:{amino_acid}"
             individual_mutations.append(mutation_key)
-    
-    return individual_mutations, combination_mutations
+
+    mutation_index = build_mutation_index(individual_mutations)
+    combination_masks = build_combination_masks(combination_mutations)
+
+    return individual_mutations, combination_mutations, mutation_index, combination_masks
+
+# Function to load a panel written by mutation_panel.py compile
+def load_mutation_panel(panel_file):
+    """
+    Return the panel dict; 'curated_mutations' holds the same tuple as
+    load_curated_mutations. Panels are pickles, so only load trusted files.
+    """
+    with open(panel_file, 'rb') as handle:
+        panel = pickle.load(handle)
+    version = panel.get('format_version') if isinstance(panel, dict) else None
+    if version != PANEL_FORMAT_VERSION:
+        raise ValueError(f"Panel '{panel_file}' has format version {version}, expected {PANEL_FORMAT_VERSION}; recompile it with mutation_panel.py compile.")
+    return panel
+
+# Function to index curated mutations so each lookup is a set membership test
+def build_mutation_index(individual_mutations):
+    """
+    Precompile the curated list into exact and wildcard lookup sets.
+
+    Exact keys are stored as 'gene:refPOSalt'. Curated entries containing 'X'
+    are additionally stored as 'gene:refPOS' so any alternative residue at that
+    position matches, mirroring the behaviour of match_mutation.
+    """
+    exact_index = set()
+    wildcard_index = set()
+
+    for curated in individual_mutations:
+        curated_gene, curated_aa = curated.split(":", 1)
+        exact_index.add(curated)
+        if 'X' in curated_aa:
+            wildcard_index.add(f"{curated_gene}:{curated_aa[:-1]}")
+
+    return exact_index, wildcard_index
+
+# Function to assign each combination member a bit and each combination a bitmask
+def build_combination_masks(combination_mutations):
+    """
+    Return (member_bits, combination_masks). member_bits maps every mutation
+    used in a combination to a bit index; combination_masks maps each
+    combination key to an integer with the bits of its members set, so a
+    combination is present when (present_mask & mask) == mask.
+    """
+    member_bits = {}
+    combination_masks = {}
+
+    for combination_key, mutation_combination in combination_mutations.items():
+        mask = 0
+        for mut in mutation_combination:
+            mask |= 1 << member_bits.setdefault(mut, len(member_bits))
+        combination_masks[combination_key] = mask
+
+    return member_bits, combination_masks
 
 # Function to match mutations, handle wildcard "X", and manage unexpected formats
 def match_mutation(mutation, curated_list):
@@ -51,118 +135,578 @@ def match_mutation(mutation, curated_list):
                 return True
     return False
 
-# Function to extract codon positions from mutations
-def extract_codon_position(mutation):
-    return ''.join(filter(str.isdigit, mutation.split(":")[1]))
+# Function to match mutations against the precompiled index from build_mutation_index
+def match_mutation_indexed(mutation, mutation_index):
+    if '-' in mutation or ':' not in mutation:
+        return False
 
-# Function to infer mutations based on absence in the All_Mutations list
-def infer_mutations(all_mutations, individual_mutations):
-    inferred = []
-    all_positions = {extract_codon_position(mut) for mut in all_mutations}
-    for curated_mut in individual_mutations:
-        curated_pos = extract_codon_position(curated_mut)
-        # If the position is not in the list of all mutations, infer that the reference amino acid is present
-        if curated_pos not in all_positions:
-            gene, aa_curated = curated_mut.split(':')
-            ref_aa = aa_curated[0]  # Take the reference amino acid
-            inferred.append(f"{gene}:{ref_aa}{curated_pos}{ref_aa}")  # Format as HA:E75E for no change
-    return inferred
-
-# Function to check mutation combinations across both curated and inferred mutations
-def check_combination_mutations(curated_mutations, inferred_mutations, combination_mutations):
-    all_mutations = set(curated_mutations.split(', ') + inferred_mutations.split(', '))
-    found_combinations = []
-    
-    for combination_key, mutation_combination in combination_mutations.items():
-        if all(mut in all_mutations for mut in mutation_combination):
-            found_combinations.append(combination_key)
-    
-    return found_combinations
+    exact_index, wildcard_index = mutation_index
+    gene, aa = mutation.split(":", 1)
+    return mutation in exact_index or f"{gene}:{aa[:-1]}" in wildcard_index
 
-# Function to process a TSV file
-def process_file(input_file, output_prefix, individual_mutations, combination_mutations):
-    df = pd.read_csv(input_file, sep='\t')
+# Function to key a mutation by its (gene, codon position), with position -1 when it has none
+def mutation_site(mutation):
+    gene, _, aa = mutation.partition(':')
+    position = ''.join(filter(str.isdigit, aa))
+    return gene, int(position) if position else -1
 
-    if 'aaSubstitutions' not in df.columns or 'seqName' not in df.columns:
-        raise ValueError("The input TSV must contain 'aaSubstitutions' and 'seqName' columns.")
-    
-    df['all_mutations'] = df[['aaSubstitutions', 'aaDeletions', 'aaInsertions']].fillna('').apply(
-        lambda row: ','.join([x for x in row if x]), axis=1
+# Function to join the Nextclade aa-change columns into one comma-separated string per sequence
+def join_mutation_columns(df):
+    all_mutations = pd.Series('', index=df.index, dtype=object)
+    for column in MUTATION_COLUMNS:
+        values = df[column].fillna('').astype(str).to_numpy(dtype=object)
+        separator = np.where((all_mutations != '') & (values != ''), ',', '')
+        all_mutations = all_mutations + separator + values
+    return all_mutations
+
+# Function to split an observed mutation into gene, amino-acid change and integer codon position
+def parse_mutation(mutation):
+    gene, position = mutation_site(mutation)
+    return gene, mutation.partition(':')[2], position
+
+# Function to explode the per-sequence mutation strings into a long table
+def explode_mutations(all_mutations):
+    """
+    Explode the comma-separated changes into a long table.
+
+    Returns (long_df, mutation_table). long_df has one row per observed aa
+    change with columns seq (row position of the sequence) and code, in the
+    order the changes appear. mutation_table is indexed by code (first-seen
+    order) with columns mutation, gene, aa and position, so each distinct
+    change is parsed only once.
+    """
+    values = all_mutations.to_numpy()
+    counts = np.fromiter((s.count(',') + 1 if s else 0 for s in values), dtype=np.int64, count=len(values))
+    tokens = np.array(','.join(s for s in values if s).split(',') if counts.sum() else [], dtype=object)
+    seq = np.repeat(np.arange(len(values)), counts)
+
+    keep = tokens != ''
+    codes, uniques = pd.factorize(tokens[keep])
+    long_df = pd.DataFrame({'seq': seq[keep], 'code': codes})
+
+    parsed = [parse_mutation(mutation) for mutation in uniques]
+    mutation_table = pd.DataFrame({
+        'mutation': np.asarray(uniques, dtype=object),
+        'gene': np.array([gene for gene, _, _ in parsed], dtype=object),
+        'aa': np.array([aa for _, aa, _ in parsed], dtype=object),
+        'position': np.array([position for _, _, position in parsed], dtype=np.int64),
+    })
+    return long_df, mutation_table
+
+# Function to flag which distinct observed mutations are curated mutations
+def match_curated(mutation_table, mutation_index):
+    return np.fromiter(
+        (match_mutation_indexed(mutation, mutation_index) for mutation in mutation_table['mutation']),
+        dtype=bool, count=len(mutation_table)
     )
 
-    # Output all mutations for each sample
-    df['All_Mutations'] = df['all_mutations']
+# Function to list the deduplicated inferred (reference) mutations for the curated list
+def build_inferred_mutations(individual_mutations):
+    """
+    Return the inferred 'gene:refPOSref' strings in curated order (duplicates
+    removed) together with the (gene, codon position) site each one depends on.
+    """
+    inferred = {}
+    for curated_mut in individual_mutations:
+        gene, curated_pos = mutation_site(curated_mut)
+        ref_aa = curated_mut.split(':')[1][0]
+        inferred.setdefault(f"{gene}:{ref_aa}{curated_pos}{ref_aa}", (gene, curated_pos))
+    return list(inferred), list(inferred.values())
+
+# Function to index (gene, position) sites so arrays of genes and positions can be looked up at once
+def site_index(sites):
+    genes = [gene for gene, _ in sites]
+    positions = [position for _, position in sites]
+    return pd.MultiIndex.from_arrays([pd.Index(genes, dtype=object), pd.Index(positions, dtype=np.int64)])
+
+# Function to build the sequence x inferred-mutation matrix
+def infer_reference_matrix(long_df, mutation_table, n_sequences, inferred_sites, covered=None):
+    """
+    Element [i, j] is True when no observed change in sequence i falls on the
+    (gene, codon position) of inferred mutation j, i.e. the reference residue
+    is inferred. With covered (a sequence x inferred-mutation matrix from
+    coverage_matrix), sites the sequence does not cover are never inferred.
+    """
+    sites = site_index(inferred_sites)
+    unique_sites = sites.unique()
+    observed = np.zeros((n_sequences, len(unique_sites)), dtype=bool)
+    site_codes = unique_sites.get_indexer(
+        pd.MultiIndex.from_arrays([mutation_table['gene'], mutation_table['position']])
+    )[long_df['code'].to_numpy()]
+    hit = site_codes >= 0
+    observed[long_df['seq'].to_numpy()[hit], site_codes[hit]] = True
+    inferred = ~observed[:, unique_sites.get_indexer(sites)]
+    return inferred if covered is None else inferred & covered
+
+# Function to read the coding segments of each gene from a Nextclade dataset annotation
+def load_gene_map(annotation):
+    """
+    Return {gene: (strand, [(start, end), ...])} with 1-based, inclusive
+    nucleotide coordinates on the reference, segments in coding order.
+    annotation is a GFF3 file or a dataset directory containing one. CDS
+    features are used when present, otherwise gene features; features are
+    named by their Name (or gene) attribute.
+    """
+    if annotation and os.path.isdir(annotation):
+        files = [os.path.join(annotation, name) for name in ANNOTATION_FILES if os.path.exists(os.path.join(annotation, name))]
+        annotation = files[0] if files else None
+    if not annotation:
+        return {}
+
+    features = {'CDS': {}, 'gene': {}}
+    with open(annotation) as handle:
+        for line in handle:
+            fields = line.rstrip('\n').split('\t')
+            if line.startswith('#') or len(fields) < 9 or fields[2] not in features:
+                continue
+            attributes = dict(item.split('=', 1) for item in fields[8].split(';') if '=' in item)
+            name = attributes.get('Name') or attributes.get('gene')
+            if name:
+                strand, segments = features[fields[2]].setdefault(name, (fields[6], []))
+                segments.append((int(fields[3]), int(fields[4])))
+
+    gene_map = features['CDS'] or features['gene']
+    for strand, segments in gene_map.values():
+        segments.sort(reverse=strand == '-')
+    return gene_map
+
+# Function to find the reference nucleotide span of one codon
+def codon_span(strand, segments, position):
+    """
+    Return (first, last) nucleotide coordinates of codon position (1-based)
+    of a gene, or None when the position lies outside its coding segments.
+    """
+    offsets = range(3 * (position - 1), 3 * position)
+    coordinates = []
+    for offset in offsets:
+        for start, end in segments:
+            length = end - start + 1
+            if offset < length:
+                coordinates.append(start + offset if strand != '-' else end - offset)
+                break
+            offset -= length
+    if position < 1 or len(coordinates) < 3:
+        return None
+    return min(coordinates), max(coordinates)
+
+# Function to list each sequence's missing (N) nucleotide ranges as a long table
+def parse_missing_ranges(missing):
+    """
+    Return (seq, start, end) arrays from the Nextclade 'missing' column,
+    where each value is a comma-separated list of 'start-end' or single
+    1-based positions.
+    """
+    values = missing.fillna('').astype(str).to_numpy()
+    seq, starts, ends = [], [], []
+    for i, value in enumerate(values):
+        for item in value.split(','):
+            if item:
+                start, _, end = item.partition('-')
+                seq.append(i)
+                starts.append(int(start))
+                ends.append(int(end or start))
+    return np.array(seq, dtype=np.int64), np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+# Function to parse the alignment range and missing ranges of every sequence
+def read_coverage(df):
+    """
+    Return (alignment_start, alignment_end, (seq, start, end) missing ranges)
+    from the Nextclade coverage columns, or None when df lacks the alignment
+    columns.
+    """
+    if not {'alignmentStart', 'alignmentEnd'}.issubset(df.columns):
+        return None
+    alignment_start = pd.to_numeric(df['alignmentStart'], errors='coerce').to_numpy()
+    alignment_end = pd.to_numeric(df['alignmentEnd'], errors='coerce').to_numpy()
+    missing = parse_missing_ranges(df['missing']) if 'missing' in df.columns else parse_missing_ranges(pd.Series([], dtype=object))
+    return alignment_start, alignment_end, missing
+
+# Function to build the sequence x inferred-mutation matrix of codons each sequence actually covers
+def coverage_matrix(coverage, inferred_sites, gene_map):
+    """
+    Element [i, j] is True when the codon of inferred site j lies inside the
+    alignment of sequence i (alignmentStart..alignmentEnd) and overlaps none
+    of its missing ranges. coverage is the result of read_coverage. Sites of
+    genes missing from gene_map are treated as covered; sequences without an
+    alignment cover nothing. Returns None without coverage or gene_map.
+    """
+    if coverage is None or not gene_map:
+        return None
+
+    alignment_start, alignment_end, (seq, starts, ends) = coverage
+    spans = [codon_span(*gene_map[gene], position) if gene in gene_map else None for gene, position in inferred_sites]
+    known = np.array([span is not None for span in spans], dtype=bool)
+    first = np.array([span[0] if span else 0 for span in spans], dtype=np.int64)
+    last = np.array([span[1] if span else 0 for span in spans], dtype=np.int64)
+
+    covered = (alignment_start[:, None] <= first) & (last <= alignment_end[:, None])
+    rows, columns = np.nonzero((starts[:, None] <= last) & (ends[:, None] >= first))
+    covered[seq[rows], columns] = False
+
+    covered[:, ~known] = True
+    return covered
+
+# Function to join the labels selected by each row of a boolean matrix
+def join_by_pattern(mask, labels):
+    """
+    Return one ', '-joined string per row of mask. Identical rows are joined
+    once and shared, so the cost grows with the number of distinct patterns.
+    """
+    if mask.shape[1] == 0:
+        return np.full(mask.shape[0], '', dtype=object)
+    patterns, inverse = np.unique(np.packbits(mask, axis=1), axis=0, return_inverse=True)
+    labels = np.asarray(labels, dtype=object)
+    unpacked = np.unpackbits(patterns, axis=1, count=mask.shape[1]).astype(bool)
+    joined = np.array([', '.join(labels[row]) for row in unpacked], dtype=object)
+    return joined[inverse.ravel()]
+
+# Function to join values per sequence, leaving sequences without values empty
+def join_by_sequence(seq, values, n_sequences):
+    """
+    Join values with ', ' for each sequence. seq must be sorted so that the
+    values of one sequence are contiguous and in output order.
+    """
+    joined = np.full(n_sequences, '', dtype=object)
+    if len(seq):
+        starts = np.flatnonzero(np.r_[True, seq[1:] != seq[:-1]])
+        joined[seq[starts]] = [', '.join(group) for group in np.split(np.asarray(values, dtype=object), starts[1:])]
+    return joined
+
+# Function to detect combinations across both curated and inferred mutations
+def detect_combinations(curated_df, mutation_table, inferred_matrix, inferred_labels, combination_masks, n_sequences):
+    """
+    Return a sequence x combination boolean matrix. Each sequence's curated
+    and inferred combination members are packed into a bitmask row, and a
+    combination is present when the row contains every bit of its mask.
+    """
+    member_bits, masks = combination_masks
+    if not masks:
+        return np.zeros((n_sequences, 0), dtype=bool)
+
+    # Set the member bits from the curated matches and from the inferred matrix
+    present = np.zeros((n_sequences, len(member_bits)), dtype=bool)
+    curated_bits = mutation_table['mutation'].map(member_bits).fillna(-1).astype(np.int64).to_numpy()[curated_df['code'].to_numpy()]
+    is_member = curated_bits >= 0
+    present[curated_df['seq'].to_numpy()[is_member], curated_bits[is_member]] = True
+    for j, label in enumerate(inferred_labels):
+        if label in member_bits:
+            present[:, member_bits[label]] |= inferred_matrix[:, j]
+
+    packed = np.packbits(present, axis=1, bitorder='little')
+    combination_matrix = np.zeros((n_sequences, len(masks)), dtype=bool)
+    for c, mask in enumerate(masks.values()):
+        mask_bytes = np.frombuffer(mask.to_bytes(packed.shape[1], 'little'), dtype=np.uint8)
+        combination_matrix[:, c] = ((packed & mask_bytes) == mask_bytes).all(axis=1)
+    return combination_matrix
+
+# Function to parse the observed mutations (and coverage) of every sequence once, for any number of panels
+def parse_sequences(df, gene_map=None):
+    """
+    Return the parsed form of a Nextclade table that screen_panel evaluates
+    each mutation list against: the joined All_Mutations strings, the long
+    mutation table from explode_mutations and, with gene_map, the coverage
+    from read_coverage.
+    """
+    all_mutations = join_mutation_columns(df)
+    long_df, mutation_table = explode_mutations(all_mutations)
+    return {
+        'n_sequences': df.shape[0],
+        'all_mutations': all_mutations.to_numpy(),
+        'long_df': long_df,
+        'mutation_table': mutation_table,
+        'coverage': read_coverage(df) if gene_map else None,
+    }
+
+# Function to screen parsed sequences against one curated mutation list
+def screen_panel(parsed, individual_mutations, combination_mutations, mutation_index, combination_masks, inferred_mutations=None, gene_map=None):
+    """
+    Return (columns, screen_result): columns maps Curated_Mutations,
+    Inferred_Mutations and Combination_Present to one value per sequence;
+    screen_result holds the intermediate tables (long mutation table,
+    inferred and combination matrices) that create_frequency_table counts
+    from. inferred_mutations is the result of build_inferred_mutations,
+    computed here if not given.
+    """
+    n_sequences = parsed['n_sequences']
+    long_df = parsed['long_df']
+    mutation_table = parsed['mutation_table']
 
     # Check for curated mutations
-    df['Curated_Mutations'] = df['all_mutations'].apply(
-        lambda x: ', '.join([mut for mut in x.split(',') if match_mutation(mut, individual_mutations)]) if pd.notna(x) else "None"
+    curated_df = long_df[match_curated(mutation_table, mutation_index)[long_df['code'].to_numpy()]]
+    curated = join_by_sequence(
+        curated_df['seq'].to_numpy(), mutation_table['mutation'].to_numpy()[curated_df['code'].to_numpy()], n_sequences
     )
 
     # Infer mutations based on absence in the All_Mutations list
-    df['Inferred_Mutations'] = df.apply(
-        lambda row: ', '.join(infer_mutations(row['All_Mutations'].split(','), individual_mutations))
-        if pd.notna(row['all_mutations']) else "None", axis=1
-    )
+    inferred_labels, inferred_sites = inferred_mutations or build_inferred_mutations(individual_mutations)
+    covered = coverage_matrix(parsed['coverage'], inferred_sites, gene_map)
+    inferred_matrix = infer_reference_matrix(long_df, mutation_table, n_sequences, inferred_sites, covered)
+    inferred = join_by_pattern(inferred_matrix, inferred_labels)
 
-    # Remove duplicates in Inferred_Mutations before cross-referencing
-    df['Inferred_Mutations'] = df['Inferred_Mutations'].apply(
-        lambda x: ', '.join(dict.fromkeys(x.split(', ')))
+    # Check for combinations across both curated and inferred mutations
+    combination_labels = list(combination_mutations)
+    combination_matrix = detect_combinations(curated_df, mutation_table, inferred_matrix, inferred_labels, combination_masks, n_sequences)
+    combinations = join_by_pattern(combination_matrix, combination_labels)
+
+    columns = {
+        'Curated_Mutations': curated,
+        'Inferred_Mutations': inferred,
+        'Combination_Present': combinations,
+    }
+    screen_result = {
+        'n_sequences': n_sequences,
+        'long_df': long_df,
+        'mutation_table': mutation_table,
+        'curated_matches': len(curated_df),
+        'inferred_labels': inferred_labels,
+        'inferred_matrix': inferred_matrix,
+        'combination_labels': combination_labels,
+        'combination_matrix': combination_matrix,
+    }
+    return columns, screen_result
+
+# Function to screen every sequence of a Nextclade table against the curated mutations
+def screen_mutations(df, individual_mutations, combination_mutations, mutation_index, combination_masks, inferred_mutations=None, gene_map=None):
+    """
+    Add the All_Mutations, Curated_Mutations, Inferred_Mutations and
+    Combination_Present columns to df.
+
+    Returns (df, screen_result); see screen_panel. With gene_map (see
+    load_gene_map) and the Nextclade alignment columns in df, reference
+    residues are only inferred at codons the sequence covers.
+    """
+    parsed = parse_sequences(df, gene_map)
+    columns, screen_result = screen_panel(
+        parsed, individual_mutations, combination_mutations, mutation_index, combination_masks, inferred_mutations, gene_map
     )
+    df['All_Mutations'] = parsed['all_mutations']
+    for column, values in columns.items():
+        df[column] = values
+    return df, screen_result
 
-    # Check for combinations across both curated and inferred mutations
-    df['Combination_Present'] = df.apply(
-        lambda row: ', '.join(check_combination_mutations(row['Curated_Mutations'], row['Inferred_Mutations'], combination_mutations))
-        if pd.notna(row['Curated_Mutations']) and pd.notna(row['Inferred_Mutations']) else "None", axis=1
+# Function to read the columns of a Nextclade TSV needed for screening
+def read_nextclade_tsv(input_file, chunk_size=None, filter_column=None, coverage=False):
+    """
+    Read seqName and the aa-change columns of a Nextclade TSV. With chunk_size,
+    return an iterator of DataFrames of at most chunk_size rows. With
+    filter_column, that column is read as well and records where it is empty
+    are dropped (see clean_tsv.clean_dataframe). With coverage, the alignment
+    and missing columns are read too when present.
+    """
+    columns = read_columns(input_file, sep='\t')
+    if 'aaSubstitutions' not in columns or 'seqName' not in columns:
+        raise ValueError("The input TSV must contain 'aaSubstitutions' and 'seqName' columns.")
+
+    wanted = {'seqName', *MUTATION_COLUMNS, *(COVERAGE_COLUMNS if coverage else [])}
+    if filter_column:
+        filter_column = resolve_filter_column(columns, filter_column)
+        wanted.add(filter_column)
+    usecols = [column for column in columns if column in wanted]
+
+    if chunk_size:
+        chunks = read_table(input_file, sep='\t', columns=usecols, chunk_size=chunk_size, dtype=str, keep_default_na=False)
+        return (clean_dataframe(chunk, filter_column) for chunk in chunks) if filter_column else chunks
+
+    # Sequence IDs are kept verbatim (e.g. '001' or 'NA') so they match the sequence map in both modes
+    df = read_table(input_file, sep='\t', columns=usecols, dtype=str, keep_default_na=False)
+    return clean_dataframe(df, filter_column).reset_index(drop=True) if filter_column else df
+
+# Function to load the IDs collapsed into each representative sequence
+def load_sequence_map(sequence_map_file):
+    """
+    Return {representative: [seqName, ...]} in file order from the
+    (seqName, representative) TSV written by data_preparation.py --dedup.
+    """
+    sequence_map = {}
+    if not sequence_map_file:
+        return sequence_map
+    df = pd.read_csv(sequence_map_file, sep='\t', dtype=str, keep_default_na=False)
+    for name, representative in zip(df['seqName'], df['representative']):
+        sequence_map.setdefault(representative, []).append(name)
+    return sequence_map
+
+# Function to expand screened representatives back to every sequence ID they stand for
+def expand_sequences(df, sequence_map):
+    """
+    Return (df, weights): df with each representative row followed by a copy
+    per collapsed ID (seqName replaced), and the number of sequences each
+    input row stands for.
+    """
+    names = df['seqName'].tolist()
+    weights = np.array([1 + len(sequence_map.get(name, ())) for name in names], dtype=np.int64)
+    if weights.sum() == len(names):
+        return df, weights
+
+    expanded = df.iloc[np.repeat(np.arange(len(names)), weights)].reset_index(drop=True)
+    expanded['seqName'] = [sequence_id for name in names for sequence_id in (name, *sequence_map.get(name, ()))]
+    return expanded, weights
+
+# Function to process a TSV file
+def process_file(input_file, output_prefix, individual_mutations, combination_mutations, mutation_index=None, combination_masks=None,
+                 chunk_size=None, filter_column=None, output_format='csv', sequence_map=None, gene_map=None, metrics=None):
+    process_panels(
+        input_file, [(output_prefix, (individual_mutations, combination_mutations, mutation_index, combination_masks))],
+        chunk_size=chunk_size, filter_column=filter_column, output_format=output_format, sequence_map=sequence_map,
+        gene_map=gene_map, metrics=metrics
     )
 
-    # Save the tables
-    df[['seqName', 'All_Mutations', 'Curated_Mutations', 'Inferred_Mutations', 'Combination_Present']].rename(
-        columns={'seqName': 'Sequence_ID'}
-    ).to_csv(f"{output_prefix}_summary.csv", index=False)
+# Function to screen a TSV file against several mutation lists in one pass
+def process_panels(input_file, panels, chunk_size=None, filter_column=None, output_format='csv', sequence_map=None, gene_map=None, metrics=None):
+    """
+    panels is a list of (output_prefix, curated_mutations) where
+    curated_mutations is the tuple returned by load_curated_mutations. Each
+    chunk is read and its mutations parsed once, then screened against every
+    panel, writing <output_prefix>_summary and _freq_summary per panel.
+    """
+    if metrics is None:
+        metrics = Metrics('mutation_screen')
+    output_prefixes = [output_prefix for output_prefix, _ in panels]
+    if len(set(output_prefixes)) != len(output_prefixes):
+        raise ValueError(f"ERROR: Output prefixes must be unique, got {output_prefixes}; panels sharing a prefix would write to the same tables.")
+
+    screens = []
+    for output_prefix, (individual_mutations, combination_mutations, mutation_index, combination_masks) in panels:
+        if mutation_index is None:
+            mutation_index = build_mutation_index(individual_mutations)
+        if combination_masks is None:
+            combination_masks = build_combination_masks(combination_mutations)
+        screens.append({
+            'output_prefix': output_prefix,
+            'curated_mutations': (individual_mutations, combination_mutations, mutation_index, combination_masks),
+            'inferred_mutations': build_inferred_mutations(individual_mutations),
+            'frequencies': {},
+        })
+
+    coverage = bool(gene_map)
+    chunks = read_nextclade_tsv(input_file, chunk_size, filter_column, coverage) if chunk_size else [read_nextclade_tsv(input_file, filter_column=filter_column, coverage=coverage)]
+    n_sequences = 0
+
+    # Save the tables, appending after the first chunk
+    with ExitStack() as stack:
+        for screen in screens:
+            screen['writer'] = stack.enter_context(TableWriter(table_path(f"{screen['output_prefix']}_summary", output_format)))
+
+        for df in metrics.timed('read', chunks):
+            with metrics.phase('parse'):
+                parsed = parse_sequences(df, gene_map)
+            metrics.count('rows_screened', parsed['n_sequences'])
+            metrics.count('mutations_observed', len(parsed['long_df']))
+
+            for screen in screens:
+                with metrics.phase('screen'):
+                    columns, screen_result = screen_panel(parsed, *screen['curated_mutations'], screen['inferred_mutations'], gene_map)
+                summary = pd.DataFrame({'seqName': df['seqName'].to_numpy(), 'All_Mutations': parsed['all_mutations'], **columns})
+                with metrics.phase('write_summary'):
+                    if sequence_map:
+                        # Identical sequences were screened once; report and count every original ID
+                        summary, screen_result['weights'] = expand_sequences(summary, sequence_map)
+                    screen['writer'].write(summary.rename(columns={'seqName': 'Sequence_ID'}))
+
+                with metrics.phase('count_frequencies'):
+                    merge_frequencies(screen['frequencies'], count_frequencies(screen_result))
+
+                metrics.count('curated_matches', screen_result['curated_matches'])
+                metrics.count('inferred_matches', screen_result['inferred_matrix'].sum())
+                metrics.count('combination_matches', screen_result['combination_matrix'].sum())
+            n_sequences += count_sequences(screen_result) if screens else 0
+
+        for screen in screens:
+            writer = screen['writer']
+            if not writer.chunks:
+                writer.write(pd.DataFrame(columns=SUMMARY_COLUMNS).rename(columns={'seqName': 'Sequence_ID'}))
+            metrics.count('rows_out', writer.rows)
 
     # Generate count and frequency tables
-    create_frequency_table(df, individual_mutations, combination_mutations, output_prefix)
+    with metrics.phase('write_frequencies'):
+        for screen in screens:
+            write_frequency_table(
+                {mutation_type: (list(counts), np.array(list(counts.values()), dtype=np.int64)) for mutation_type, counts in screen['frequencies'].items()},
+                n_sequences, screen['output_prefix'], output_format
+            )
 
-def create_frequency_table(df, individual_mutations, combination_mutations, output_prefix):
-    mutation_counter = Counter()
-    combination_counter = Counter()
-    inferred_counter = Counter()
+# Function to count how many sequences have each column of a boolean matrix set
+def count_matrix_columns(matrix, labels, weights=None):
+    """
+    Return (labels, counts) for the columns set in at least one row, ordered by
+    the first row each column appears in and then by column order, i.e. the
+    order a row-by-row scan would first encounter them. With weights, row i
+    counts weights[i] times.
+    """
+    counts = matrix.sum(axis=0) if weights is None else weights @ matrix
+    present = np.flatnonzero(counts)
+    if not present.size:
+        return np.array([], dtype=object), counts[present]
+    first_row = matrix[:, present].argmax(axis=0)
+    order = present[np.lexsort((present, first_row))]
+    return np.asarray(labels, dtype=object)[order], counts[order]
 
-    for _, row in df.iterrows():
-        all_mutations = row['All_Mutations'].split(',')
-        for mut in all_mutations:
-            mut = mut.strip()
-            if mut and mut != "None":
-                mutation_counter[mut] += 1
+# Function to count the sequences a screening result stands for (more than its rows when deduplicated)
+def count_sequences(screen_result):
+    weights = screen_result.get('weights')
+    return screen_result['n_sequences'] if weights is None else int(weights.sum())
 
-        if pd.notna(row['Combination_Present']) and row['Combination_Present'] != "None":
-            for comb in row['Combination_Present'].split(', '):
-                if comb:
-                    combination_counter[comb] += 1
+# Function to count Individual, Combination and Inferred occurrences from a screening result
+def count_frequencies(screen_result):
+    long_df = screen_result['long_df']
+    mutation_table = screen_result['mutation_table']
+    weights = screen_result.get('weights')
 
-        inferred_mutations = row['Inferred_Mutations'].split(',')
-        for inferred in inferred_mutations:
-            inferred = inferred.strip()
-            if inferred and inferred != "None":
-                inferred_counter[inferred] += 1
+    # Mutation codes are assigned in first-seen order, so bincount keeps that order
+    codes = long_df['code'].to_numpy()
+    if weights is None:
+        mutation_counts = np.bincount(codes, minlength=len(mutation_table))
+    else:
+        mutation_counts = np.bincount(codes, weights=weights[long_df['seq'].to_numpy()], minlength=len(mutation_table)).astype(np.int64)
+    keep = (mutation_counts > 0) & (mutation_table['mutation'] != "None").to_numpy()
 
-    # Prepare mutation frequency DataFrame
-    mutation_df = pd.DataFrame(list(mutation_counter.items()), columns=['Mutation/Combination', 'Count'])
-    mutation_df['Type'] = 'Individual'
+    return {
+        'Individual': (mutation_table['mutation'].to_numpy()[keep], mutation_counts[keep]),
+        'Combination': count_matrix_columns(screen_result['combination_matrix'], screen_result['combination_labels'], weights),
+        'Inferred': count_matrix_columns(screen_result['inferred_matrix'], screen_result['inferred_labels'], weights),
+    }
 
-    combination_df = pd.DataFrame(list(combination_counter.items()), columns=['Mutation/Combination', 'Count'])
-    combination_df['Type'] = 'Combination'
+# Function to add the counts of one chunk to running totals, keeping first-seen order
+def merge_frequencies(totals, frequencies):
+    for mutation_type, (labels, counts) in frequencies.items():
+        type_totals = totals.setdefault(mutation_type, {})
+        for label, count in zip(labels, counts.tolist()):
+            type_totals[label] = type_totals.get(label, 0) + count
+    return totals
 
-    inferred_df = pd.DataFrame(list(inferred_counter.items()), columns=['Mutation/Combination', 'Count'])
-    inferred_df['Type'] = 'Inferred'
+# Function to write the count and frequency table
+def write_frequency_table(frequencies, n_sequences, output_prefix, output_format='csv'):
+    frames = []
+    for mutation_type in ['Individual', 'Combination', 'Inferred']:
+        labels, counts = frequencies.get(mutation_type, ([], np.array([], dtype=np.int64)))
+        frame = pd.DataFrame({'Mutation/Combination': np.asarray(labels, dtype=object), 'Count': counts})
+        frame['Type'] = mutation_type
+        frames.append(frame)
 
     # Merge all frequency DataFrames and calculate frequency
-    combined_df = pd.concat([mutation_df, combination_df, inferred_df])
-    combined_df['Frequency'] = combined_df['Count'] / df.shape[0]
+    combined_df = pd.concat(frames)
+    combined_df['Frequency'] = combined_df['Count'] / n_sequences
+
+    with TableWriter(table_path(f"{output_prefix}_freq_summary", output_format)) as writer:
+        writer.write(combined_df)
 
-    combined_df.to_csv(f"{output_prefix}_freq_summary.csv", index=False)
+def create_frequency_table(screen_result, output_prefix, output_format='csv'):
+    write_frequency_table(count_frequencies(screen_result), count_sequences(screen_result), output_prefix, output_format)
 
 if __name__ == '__main__':
     args = parse_arguments()
-    individual_mutations, combination_mutations = load_curated_mutations(args.mutations_csv) if args.mutations_csv else ([], {})
-    process_file(args.input_file, args.output_prefix, individual_mutations, combination_mutations)
\ No newline at end of file
+    metrics = Metrics('mutation_screen', args.metrics, args.profile)
+    mutation_lists = args.mutations_csv or [None]
+    if len(args.output_prefix) != len(mutation_lists):
+        raise SystemExit(f"ERROR: Got {len(mutation_lists)} mutation lists but {len(args.output_prefix)} output prefixes; give one prefix per list.")
+    if len(set(args.output_prefix)) != len(args.output_prefix):
+        raise SystemExit(f"ERROR: Output prefixes must be unique, got {args.output_prefix}.")
+    with metrics.phase('load_mutations'):
+        panels = [
+            (output_prefix, load_curated_mutations(mutations_csv) if mutations_csv else ([], {}, (set(), set()), ({}, {})))
+            for output_prefix, mutations_csv in zip(args.output_prefix, mutation_lists)
+        ]
+        sequence_map = load_sequence_map(args.sequence_map)
+        gene_map = load_gene_map(args.gene_map)
+    process_panels(args.input_file, panels, chunk_size=args.chunk_size, filter_column=args.filter_column if args.clean else None,
+                   output_format=args.output_format, sequence_map=sequence_map, gene_map=gene_map, metrics=metrics)
+    metrics.write()
\ No newline at end of file
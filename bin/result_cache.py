@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from checkpoint import path_digest
+
+# Function to hash a sequence independently of line wrapping and case
+def sequence_hash(lines):
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(''.join(line.split()).upper().encode())
+    return digest.hexdigest()
+
+# Function to fingerprint a Nextclade dataset from all of its files (plus anything else results depend on, e.g. the Nextclade version)
+def dataset_fingerprint(dataset_dir, extra=''):
+    return hashlib.sha256(f"{extra}\n{path_digest(dataset_dir)}".encode()).hexdigest()
+
+class ResultCache:
+    """
+    On-disk SQLite cache of per-sequence Nextclade rows.
+
+    Rows are keyed by (sequence SHA-256, dataset fingerprint) and stored as
+    JSON objects of the Nextclade TSV columns (without index and seqName).
+    evict() deletes the least recently used rows once the cache exceeds a
+    size limit.
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS nextclade_rows (
+                seq_hash TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                row TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (seq_hash, dataset)
+            );
+            CREATE INDEX IF NOT EXISTS nextclade_rows_last_used ON nextclade_rows (last_used);
+            CREATE TABLE IF NOT EXISTS nextclade_headers (
+                dataset TEXT PRIMARY KEY,
+                header TEXT NOT NULL
+            );
+        """)
+
+    def get_header(self, dataset):
+        found = self.connection.execute('SELECT header FROM nextclade_headers WHERE dataset = ?', (dataset,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def put_header(self, dataset, header):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO nextclade_headers VALUES (?, ?)', (dataset, json.dumps(header)))
+
+    def get_rows(self, dataset, seq_hashes):
+        """
+        Return {seq_hash: row} for the hashes found in the cache and mark them as used.
+        """
+        seq_hashes = list(dict.fromkeys(seq_hashes))
+        found = {}
+        now = time.time()
+        with self.connection:
+            for start in range(0, len(seq_hashes), self.BATCH_SIZE):
+                batch = seq_hashes[start:start + self.BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                query = f'SELECT seq_hash, row FROM nextclade_rows WHERE dataset = ? AND seq_hash IN ({placeholders})'
+                for seq_hash, row in self.connection.execute(query, (dataset, *batch)):
+                    found[seq_hash] = json.loads(row)
+                self.connection.execute(
+                    f'UPDATE nextclade_rows SET last_used = ? WHERE dataset = ? AND seq_hash IN ({placeholders})',
+                    (now, dataset, *batch)
+                )
+        return found
+
+    def missing(self, dataset, seq_hashes):
+        """
+        Return the set of hashes that are not cached for the dataset.
+        """
+        seq_hashes = list(dict.fromkeys(seq_hashes))
+        cached = set()
+        for start in range(0, len(seq_hashes), self.BATCH_SIZE):
+            batch = seq_hashes[start:start + self.BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            query = f'SELECT seq_hash FROM nextclade_rows WHERE dataset = ? AND seq_hash IN ({placeholders})'
+            cached.update(seq_hash for (seq_hash,) in self.connection.execute(query, (dataset, *batch)))
+        return set(seq_hashes) - cached
+
+    def put_rows(self, dataset, rows):
+        """
+        Store {seq_hash: row} for a dataset.
+        """
+        now = time.time()
+        with self.connection:
+            for seq_hash, row in rows.items():
+                encoded = json.dumps(row)
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO nextclade_rows VALUES (?, ?, ?, ?, ?)',
+                    (seq_hash, dataset, encoded, len(encoded), now)
+                )
+
+    def size(self):
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM nextclade_rows').fetchone()[0]
+
+    def evict(self, max_bytes):
+        """
+        Delete least recently used rows until the cached rows total at most max_bytes.
+        Returns the number of rows deleted.
+        """
+        excess = self.size() - max_bytes
+        deleted = 0
+        if excess <= 0:
+            return deleted
+
+        with self.connection:
+            rows = self.connection.execute('SELECT rowid, size FROM nextclade_rows ORDER BY last_used')
+            doomed = []
+            for rowid, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((rowid,))
+                excess -= size
+            self.connection.executemany('DELETE FROM nextclade_rows WHERE rowid = ?', doomed)
+            deleted = len(doomed)
+        return deleted
+
+    def close(self):
+        self.connection.close()
@@ -2,16 +2,37 @@
 
 import os
 import sys
+import json
+import shutil
 import argparse
+import tempfile
 import subprocess
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from table_io import table_path
+from mutation_panel import drop_shadowed_panels, mutation_list_name
+from checkpoint import Manifest, fingerprint, path_digest
+from instrumentation import Metrics, add_metrics_arguments
+
+# Manifest of completed dataset screens kept in the output directory with --resume
+SCREEN_MANIFEST = 'screen_manifest.json'
 
 def parse_arguments():
-    parser = argparse.ArgumentParser(description='Run mutation analysis on cleaned TSV files with corresponding mutation lists.')
-    parser.add_argument('-t', '--tsv_dir', required=True, help='Directory containing cleaned TSV files.')
-    parser.add_argument('-m', '--mutations_dir', required=True, help='Directory containing mutation list CSV files.')
+    parser = argparse.ArgumentParser(description='Run mutation analysis on Nextclade TSV files with corresponding mutation lists.')
+    parser.add_argument('-t', '--tsv_dir', required=True, help='Directory containing cleaned (or, with --clean, raw) Nextclade TSV files.')
+    parser.add_argument('-m', '--mutations_dir', required=True, help='Directory containing mutation list CSV files (or compiled panels); a dataset may have several, screened in one pass.')
     parser.add_argument('-d', '--nextclade_datasets', required=True, help='Directory containing Nextclade datasets.')
     parser.add_argument('-s', '--mutation_script', required=True, help='Path to the mutation analysis script (mutation_screen_vNextGen.py).')
     parser.add_argument('-o', '--output_dir', required=True, help='Directory to store mutation analysis results.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Screen datasets in-process with a pool of this many worker processes instead of one subprocess per dataset.')
+    parser.add_argument('--clean', action='store_true', help='TSV files are raw Nextclade output; drop failed records while screening instead of reading cleaned copies.')
+    parser.add_argument('-f', '--filter_column', default=None, help='Column used by --clean to detect failed records (default: the mutation analysis script default).')
+    parser.add_argument('--output_format', choices=['csv', 'parquet'], default='csv', help='Format of the per-dataset summary and frequency tables.')
+    parser.add_argument('-c', '--chunk_size', type=int, default=None, help='Stream each TSV in chunks of this many rows (passed on to the mutation analysis script).')
+    parser.add_argument('--sequence_map', default=None, help='Sequence map from data_preparation.py --dedup; results of collapsed sequences are expanded to every original ID.')
+    parser.add_argument('--ignore_coverage', action='store_true', help="Infer reference residues at every curated position without an observed change, even where the sequence has no coverage.")
+    parser.add_argument('--resume', action='store_true', help=f'Record each completed dataset in {SCREEN_MANIFEST} in the output directory and skip datasets whose inputs are unchanged since.')
+    add_metrics_arguments(parser)
     return parser.parse_args()
 
 def find_matching_file(base_name, files, file_type):
@@ -28,6 +49,220 @@ def find_matching_file(base_name, files, file_type):
         sys.exit(1)
     return matches[0]
 
+def find_matching_files(base_name, files, file_type, dataset_names):
+    """
+    Finds every file in the provided list where base_name appears as a
+    substring, skipping files that belong to a longer dataset name containing
+    base_name. Raises an error if no match is found.
+    """
+    longer_names = [name for name in dataset_names if name != base_name and base_name in name]
+    matches = sorted(f for f in files if base_name in f and not any(name in f for name in longer_names))
+    if len(matches) == 0:
+        print(f"Error: No matching {file_type} file found for dataset '{base_name}'", file=sys.stderr)
+        sys.exit(1)
+    return matches
+
+# Function to name the outputs of one mutation list: the dataset name, or the list's own name when a dataset has several
+def panel_output_name(dataset_name, mutation_file, n_lists):
+    return dataset_name if n_lists == 1 else mutation_list_name(mutation_file)
+
+# Function to name the cProfile output of one dataset after the task-level profile file
+def dataset_profile_file(profile_file, dataset_name):
+    if not profile_file:
+        return None
+    root, extension = os.path.splitext(profile_file)
+    return f"{root}.{dataset_name}{extension or '.prof'}"
+
+# Function to list the summary and frequency tables written for a dataset
+def dataset_outputs(output_prefixes, output_format='csv'):
+    return [table_path(f"{prefix}{suffix}", output_format) for prefix in output_prefixes for suffix in ('_summary', '_freq_summary')]
+
+# Function to identify a mutation list by content; compiled panels by their panel ID, as their pickles are not byte-stable
+def mutation_list_digest(mutation_screen, mutation_path):
+    if mutation_path.endswith(mutation_screen.PANEL_SUFFIX):
+        panel = mutation_screen.load_mutation_panel(mutation_path)
+        return f"panel:{panel['format_version']}:{panel['panel_id']}"
+    return path_digest(mutation_path)
+
+# Function to select the datasets that need screening, given the manifest of earlier runs
+def select_pending_tasks(tasks, manifest, mutation_script, options, sequence_map_file=None, metrics=None):
+    """
+    Each dataset is fingerprinted from the hashes of its TSV, mutation lists,
+    sequence map, Nextclade dataset (used for coverage) and the screening
+    script's directory, plus the options that change its outputs. Returns
+    (pending tasks, {dataset: (fingerprint, outputs)}). Outputs of datasets
+    no longer screened, or of outdated entries, are removed.
+    """
+    if metrics is None:
+        metrics = Metrics('run_mutation_analysis')
+    mutation_screen = load_mutation_screen(mutation_script)
+    sequence_map_digest = path_digest(sequence_map_file)
+    # The screening script's sibling modules (clean_tsv, table_io, ...) shape its outputs too, so hash its whole directory
+    script_digest = path_digest(os.path.dirname(os.path.abspath(mutation_script)))
+
+    pending = []
+    checkpoints = {}
+    for task in tasks:
+        dataset_name, matching_tsv_path, matching_mutation_paths, output_prefixes, dataset_dir = task
+        inputs_fingerprint = fingerprint({
+            'tsv': path_digest(matching_tsv_path),
+            'mutation_lists': [mutation_list_digest(mutation_screen, path) for path in matching_mutation_paths],
+            'output_names': [os.path.basename(prefix) for prefix in output_prefixes],
+            'sequence_map': sequence_map_digest,
+            'dataset': path_digest(dataset_dir),
+            'script': script_digest,
+            'options': options,
+        })
+        outputs = dataset_outputs(output_prefixes, options['output_format'])
+        if manifest.is_current(dataset_name, inputs_fingerprint):
+            print(f"Skipping {dataset_name}: outputs are up to date")
+            metrics.count('datasets_skipped')
+            continue
+        checkpoints[dataset_name] = (inputs_fingerprint, outputs)
+        pending.append(task)
+
+    # Drop the records (and outputs) of datasets that are not current, so stale tables never reach the combiner
+    dataset_names = {task[0] for task in tasks}
+    for dataset_name in list(manifest.entries):
+        if dataset_name in checkpoints or dataset_name not in dataset_names:
+            for output in manifest.get(dataset_name)['outputs']:
+                if os.path.exists(output):
+                    os.remove(output)
+            manifest.discard(dataset_name)
+    return pending, checkpoints
+
+# Function to record a successfully screened dataset in the manifest
+def record_checkpoint(manifest, checkpoints, dataset_name):
+    if manifest is not None:
+        inputs_fingerprint, outputs = checkpoints[dataset_name]
+        manifest.record(dataset_name, inputs_fingerprint, outputs)
+
+def load_mutation_screen(mutation_script):
+    """
+    Import the mutation analysis script as a library module (cached per process).
+    """
+    if 'mutation_screen' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('mutation_screen', mutation_script)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['mutation_screen'] = module
+        spec.loader.exec_module(module)
+    return sys.modules['mutation_screen']
+
+def screen_dataset(mutation_script, dataset_name, tsv_path, panels, chunk_size=None, clean=False, filter_column=None, output_format='csv',
+                   sequence_map_file=None, profile_file=None, dataset_dir=None):
+    """
+    Screen one TSV against its already parsed mutation lists, given as
+    (output_prefix, curated_mutations) pairs, in a single pass. Runs in a
+    worker process and returns the dataset's metrics dict. With dataset_dir,
+    its annotation limits inferred reference residues to covered codons.
+    """
+    metrics = Metrics(dataset_name, profile_file=profile_file)
+    mutation_screen = load_mutation_screen(mutation_script)
+    if clean and not filter_column:
+        filter_column = mutation_screen.FILTER_COLUMN
+    with metrics.phase('load_sequence_map'):
+        sequence_map = mutation_screen.load_sequence_map(sequence_map_file)
+    gene_map = mutation_screen.load_gene_map(dataset_dir)
+    mutation_screen.process_panels(
+        tsv_path, panels, chunk_size=chunk_size, filter_column=filter_column if clean else None,
+        output_format=output_format, sequence_map=sequence_map, gene_map=gene_map, metrics=metrics
+    )
+    metrics.write()
+    return metrics.to_dict()
+
+def run_subprocesses(tasks, mutation_script, chunk_size=None, clean=False, filter_column=None, output_format='csv', sequence_map_file=None, metrics=None,
+                     manifest=None, checkpoints=None):
+    if metrics is None:
+        metrics = Metrics('run_mutation_analysis')
+    metrics_dir = tempfile.mkdtemp()
+    failed = False
+    for dataset_name, matching_tsv_path, matching_mutation_paths, output_prefixes, dataset_dir in tasks:
+        matching_mutation_path = ', '.join(matching_mutation_paths)
+        print(f"Processing {matching_tsv_path} with {matching_mutation_path}")
+
+        cmd = [
+            'python', mutation_script,
+            '-i', matching_tsv_path,
+            '-m', *matching_mutation_paths,
+            '-o', *output_prefixes
+        ]
+        if chunk_size:
+            cmd += ['-c', str(chunk_size)]
+        if clean:
+            cmd += ['--clean']
+        if filter_column:
+            cmd += ['-f', filter_column]
+        if output_format != 'csv':
+            cmd += ['--output_format', output_format]
+        if sequence_map_file:
+            cmd += ['--sequence_map', sequence_map_file]
+        if dataset_dir:
+            cmd += ['--gene_map', dataset_dir]
+        dataset_metrics_file = os.path.join(metrics_dir, f"{dataset_name}.json")
+        cmd += ['--metrics', dataset_metrics_file]
+        if metrics.profile_file:
+            cmd += ['--profile', dataset_profile_file(metrics.profile_file, dataset_name)]
+
+        try:
+            subprocess.run(cmd, check=True)
+            with open(dataset_metrics_file) as handle:
+                metrics.add_dataset(dataset_name, json.load(handle))
+            record_checkpoint(manifest, checkpoints, dataset_name)
+            print(f"Successfully processed {matching_tsv_path} with {matching_mutation_path}")
+        except subprocess.CalledProcessError as e:
+            # Carry on with the other datasets so a rerun with --resume only has to redo this one
+            print(f"Error processing {matching_tsv_path} with {matching_mutation_path}", file=sys.stderr)
+            failed = True
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    if failed:
+        sys.exit(1)
+
+def run_pool(tasks, mutation_script, jobs, chunk_size=None, clean=False, filter_column=None, output_format='csv', sequence_map_file=None, metrics=None,
+             manifest=None, checkpoints=None):
+    if metrics is None:
+        metrics = Metrics('run_mutation_analysis')
+    mutation_screen = load_mutation_screen(mutation_script)
+
+    # Parse each mutation list once and share it with every dataset that uses it
+    curated = {}
+    with metrics.phase('load_mutations'):
+        for _, _, matching_mutation_paths, _, _ in tasks:
+            for matching_mutation_path in matching_mutation_paths:
+                if matching_mutation_path not in curated:
+                    try:
+                        curated[matching_mutation_path] = mutation_screen.load_curated_mutations(matching_mutation_path)
+                    except Exception as e:
+                        print(f"Error loading mutation list {matching_mutation_path}: {e}", file=sys.stderr)
+                        sys.exit(1)
+
+    failed = False
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for dataset_name, matching_tsv_path, matching_mutation_paths, output_prefixes, dataset_dir in tasks:
+            matching_mutation_path = ', '.join(matching_mutation_paths)
+            print(f"Processing {matching_tsv_path} with {matching_mutation_path}")
+            panels = [(output_prefix, curated[path]) for output_prefix, path in zip(output_prefixes, matching_mutation_paths)]
+            future = executor.submit(
+                screen_dataset, mutation_script, dataset_name, matching_tsv_path, panels,
+                chunk_size, clean, filter_column, output_format, sequence_map_file,
+                dataset_profile_file(metrics.profile_file, dataset_name), dataset_dir
+            )
+            futures[future] = (matching_tsv_path, matching_mutation_path, dataset_name)
+
+        for future in as_completed(futures):
+            matching_tsv_path, matching_mutation_path, dataset_name = futures[future]
+            try:
+                metrics.add_dataset(dataset_name, future.result())
+                record_checkpoint(manifest, checkpoints, dataset_name)
+                print(f"Successfully processed {matching_tsv_path} with {matching_mutation_path}")
+            except Exception as e:
+                print(f"Error processing {matching_tsv_path} with {matching_mutation_path}: {e}", file=sys.stderr)
+                failed = True
+
+    if failed:
+        sys.exit(1)
+
 def main():
     args = parse_arguments()
 
@@ -47,29 +282,47 @@ def main():
     mutation_files = os.listdir(mutations_dir)
 
     # Match datasets, TSV files, and mutation files
+    tasks = []
     for dataset_name in dataset_names:
         matching_tsv_file = find_matching_file(dataset_name, tsv_files, "TSV")
-        matching_mutation_file = find_matching_file(dataset_name, mutation_files, "mutation list")
+        matching_mutation_files = drop_shadowed_panels(find_matching_files(dataset_name, mutation_files, "mutation list", dataset_names))
 
         matching_tsv_path = os.path.join(tsv_dir, matching_tsv_file)
-        matching_mutation_path = os.path.join(mutations_dir, matching_mutation_file)
-        output_prefix = os.path.join(output_dir, dataset_name)
+        matching_mutation_paths = [os.path.join(mutations_dir, f) for f in matching_mutation_files]
+        output_prefixes = [
+            os.path.join(output_dir, panel_output_name(dataset_name, f, len(matching_mutation_files))) for f in matching_mutation_files
+        ]
+        # The dataset annotation maps curated codons to the reference coordinates Nextclade reports coverage in
+        dataset_dir = None if args.ignore_coverage else os.path.join(nextclade_datasets_dir, dataset_name)
+        tasks.append((dataset_name, matching_tsv_path, matching_mutation_paths, output_prefixes, dataset_dir))
 
-        print(f"Processing {matching_tsv_path} with {matching_mutation_path}")
+    # Two lists writing to the same prefix would interleave their rows in one table, so stop before screening anything
+    output_prefixes = [prefix for task in tasks for prefix in task[3]]
+    duplicates = sorted({prefix for prefix in output_prefixes if output_prefixes.count(prefix) > 1})
+    if duplicates:
+        print(f"Error: Several mutation lists would write to the same outputs: {duplicates}. Rename the lists so each has its own name.", file=sys.stderr)
+        sys.exit(1)
 
-        cmd = [
-            'python', mutation_script,
-            '-i', matching_tsv_path,
-            '-m', matching_mutation_path,
-            '-o', output_prefix
-        ]
+    # Workers report per-dataset metrics and, with --profile, write <profile>.<dataset>.prof next to the parent's profile
+    metrics = Metrics('run_mutation_analysis', args.metrics, args.profile)
 
-        try:
-            subprocess.run(cmd, check=True)
-            print(f"Successfully processed {matching_tsv_path} with {matching_mutation_path}")
-        except subprocess.CalledProcessError as e:
-            print(f"Error processing {matching_tsv_path} with {matching_mutation_path}", file=sys.stderr)
-            sys.exit(1)
+    # With --resume, only datasets whose inputs changed since their last successful screen are run again
+    manifest = None
+    checkpoints = None
+    if args.resume:
+        manifest = Manifest(os.path.join(output_dir, SCREEN_MANIFEST))
+        options = {'clean': args.clean, 'filter_column': args.filter_column, 'output_format': args.output_format}
+        with metrics.phase('check_manifest'):
+            tasks, checkpoints = select_pending_tasks(tasks, manifest, mutation_script, options, args.sequence_map, metrics)
+
+    with metrics.phase('screen_datasets'):
+        if args.jobs:
+            run_pool(tasks, mutation_script, args.jobs, args.chunk_size, args.clean, args.filter_column, args.output_format, args.sequence_map, metrics,
+                     manifest, checkpoints)
+        else:
+            run_subprocesses(tasks, mutation_script, args.chunk_size, args.clean, args.filter_column, args.output_format, args.sequence_map, metrics,
+                             manifest, checkpoints)
+    metrics.write()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
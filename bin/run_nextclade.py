@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import glob
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from result_cache import ResultCache, dataset_fingerprint, sequence_hash
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Run Nextclade over every dataset concurrently within a CPU budget.')
+    parser.add_argument('-i', '--fasta_dir', required=True, help='Directory containing the prepared FASTA files.')
+    parser.add_argument('-d', '--nextclade_datasets', required=True, help='Directory containing Nextclade datasets.')
+    parser.add_argument('-o', '--output_dir', required=True, help='Directory to store one Nextclade TSV per dataset.')
+    parser.add_argument('-c', '--cpus', type=int, default=os.cpu_count() or 1, help='Total number of CPUs shared by all Nextclade runs.')
+    parser.add_argument('-s', '--shard_size', type=int, default=0, help='Split the input into shards of this many sequences and merge the results (default: 0, no sharding).')
+    parser.add_argument('-n', '--nextclade', default='nextclade', help='Nextclade executable to run.')
+    parser.add_argument('--cache', default=None, help='SQLite result cache; only sequences missing from it are sent to Nextclade.')
+    parser.add_argument('--cache_max_mb', type=float, default=10240, help='Evict least recently used cache entries above this size in MB (default: 10240).')
+    return parser.parse_args()
+
+# Function to iterate over FASTA records as (header, sequence lines) without loading whole files
+def read_fasta_records(fasta_file):
+    header = None
+    lines = []
+    with open(fasta_file) as handle:
+        for line in handle:
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, lines
+                header = line
+                lines = []
+            elif header is not None:
+                lines.append(line)
+    if header is not None:
+        yield header, lines
+
+# Function to split the input FASTA files into shards of at most shard_size records
+def shard_fasta_files(fasta_files, shard_dir, shard_size):
+    """
+    Returns a list of (shard_path, record_count) in input order.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = []
+    handle = None
+
+    for fasta_file in fasta_files:
+        for header, lines in read_fasta_records(fasta_file):
+            if handle is None or shards[-1][1] == shard_size:
+                if handle is not None:
+                    handle.close()
+                shard_path = os.path.join(shard_dir, f"shard_{len(shards):05d}.fasta")
+                handle = open(shard_path, 'w')
+                shards.append([shard_path, 0])
+            handle.write(header if header.endswith('\n') else header + '\n')
+            handle.writelines(lines)
+            if lines and not lines[-1].endswith('\n'):
+                handle.write('\n')
+            shards[-1][1] += 1
+
+    if handle is not None:
+        handle.close()
+    return [tuple(shard) for shard in shards]
+
+# Function to split the CPU budget between concurrent Nextclade runs
+def plan_cpus(n_tasks, cpus):
+    """
+    Returns (concurrent_runs, jobs_per_run) so that concurrent_runs * jobs_per_run <= cpus.
+    """
+    cpus = max(1, cpus)
+    concurrent_runs = max(1, min(n_tasks, cpus))
+    return concurrent_runs, max(1, cpus // concurrent_runs)
+
+def run_nextclade(nextclade, dataset_dir, input_files, output_tsv, jobs):
+    cmd = [
+        nextclade, 'run',
+        *input_files,
+        '--output-tsv', output_tsv,
+        '--input-dataset', dataset_dir,
+        '--jobs', str(jobs)
+    ]
+    subprocess.run(cmd, check=True)
+    return output_tsv
+
+# Function to concatenate per-shard TSVs, keeping one header and renumbering the index column
+def merge_tsv_files(shard_tsvs, shard_counts, output_tsv):
+    offset = 0
+    with open(output_tsv, 'w') as out:
+        for i, (shard_tsv, count) in enumerate(zip(shard_tsvs, shard_counts)):
+            with open(shard_tsv) as handle:
+                header = handle.readline()
+                if i == 0:
+                    out.write(header)
+                renumber = header.split('\t', 1)[0] == 'index'
+                for line in handle:
+                    if renumber:
+                        index, sep, rest = line.partition('\t')
+                        if index.isdigit():
+                            line = f"{int(index) + offset}{sep}{rest}"
+                    out.write(line)
+            offset += count
+
+# Function to run Nextclade for every dataset, sharding the inputs if requested
+def run_datasets(dataset_inputs, output_paths, work_dir, nextclade, cpus, shard_size=0):
+    """
+    dataset_inputs maps dataset name -> (dataset_dir, input FASTA files) and
+    output_paths maps dataset name -> output TSV. Returns False if any run failed.
+    """
+    # Shard each distinct input once, even when several datasets share it
+    shard_sets = {}
+    dataset_shards = {}
+    for dataset_name, (_, input_files) in dataset_inputs.items():
+        key = tuple(input_files)
+        if key not in shard_sets:
+            if shard_size > 0:
+                shard_dir = os.path.join(work_dir, 'shards', f"{len(shard_sets):03d}")
+                shard_sets[key] = shard_fasta_files(input_files, shard_dir, shard_size)
+                print(f"Split {sum(count for _, count in shard_sets[key])} sequences into {len(shard_sets[key])} shards")
+            else:
+                shard_sets[key] = [(None, 0)]
+        dataset_shards[dataset_name] = shard_sets[key]
+
+    # One task per (dataset, shard)
+    tasks = []
+    for dataset_name, (dataset_dir, input_files) in dataset_inputs.items():
+        shards = dataset_shards[dataset_name]
+        for shard_number, (shard_path, _) in enumerate(shards):
+            if len(shards) == 1:
+                output_tsv = output_paths[dataset_name]
+            else:
+                output_tsv = os.path.join(work_dir, dataset_name, f"shard_{shard_number:05d}.tsv")
+                os.makedirs(os.path.dirname(output_tsv), exist_ok=True)
+            tasks.append((dataset_name, dataset_dir, [shard_path] if shard_path else input_files, output_tsv))
+
+    concurrent_runs, jobs = plan_cpus(len(tasks), cpus)
+    print(f"Running {len(tasks)} Nextclade tasks, {concurrent_runs} at a time with --jobs {jobs}")
+
+    failed = False
+    with ThreadPoolExecutor(max_workers=concurrent_runs) as executor:
+        futures = {}
+        for dataset_name, dataset_dir, input_files, output_tsv in tasks:
+            future = executor.submit(run_nextclade, nextclade, dataset_dir, input_files, output_tsv, jobs)
+            futures[future] = (dataset_name, output_tsv)
+
+        for future in as_completed(futures):
+            dataset_name, output_tsv = futures[future]
+            try:
+                future.result()
+                print(f"Nextclade finished for dataset: {dataset_name} ({output_tsv})")
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"Error running Nextclade on dataset '{dataset_name}': {e}", file=sys.stderr)
+                failed = True
+
+    if failed:
+        return False
+
+    # Merge shard outputs into one TSV per dataset
+    for dataset_name, shards in dataset_shards.items():
+        if len(shards) > 1:
+            shard_tsvs = [output_tsv for name, _, _, output_tsv in tasks if name == dataset_name]
+            merge_tsv_files(shard_tsvs, [count for _, count in shards], output_paths[dataset_name])
+            print(f"Merged {len(shard_tsvs)} shards for dataset: {dataset_name}")
+    return True
+
+# Function to list (sequence name, sequence hash) for every input record, in input order
+def hash_fasta_records(fasta_files):
+    return [
+        (header[1:].strip(), sequence_hash(lines))
+        for fasta_file in fasta_files
+        for header, lines in read_fasta_records(fasta_file)
+    ]
+
+# Function to write the sequences each dataset still needs, named by their hash
+def write_missing_fasta(fasta_files, missing_by_dataset, work_dir):
+    """
+    Writes one FASTA per dataset with every missing sequence once, using the
+    sequence hash as its name. Returns dataset name -> FASTA path.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    paths = {name: os.path.join(work_dir, f"{name}_missing.fasta") for name, missing in missing_by_dataset.items() if missing}
+    handles = {name: open(path, 'w') for name, path in paths.items()}
+    written = {name: set() for name in paths}
+
+    for fasta_file in fasta_files:
+        for _, lines in read_fasta_records(fasta_file):
+            seq_hash = sequence_hash(lines)
+            for name, handle in handles.items():
+                if seq_hash in missing_by_dataset[name] and seq_hash not in written[name]:
+                    handle.write(f">{seq_hash}\n")
+                    handle.write(''.join(''.join(line.split()) for line in lines) + '\n')
+                    written[name].add(seq_hash)
+
+    for handle in handles.values():
+        handle.close()
+    return paths
+
+# Function to store the rows of a Nextclade TSV whose seqName is a sequence hash
+def store_nextclade_rows(cache, fingerprint, nextclade_tsv):
+    with open(nextclade_tsv, newline='') as handle:
+        reader = csv.DictReader(handle, delimiter='\t')
+        cache.put_header(fingerprint, reader.fieldnames)
+        rows = {}
+        for row in reader:
+            seq_hash = row.pop('seqName')
+            row.pop('index', None)
+            rows[seq_hash] = row
+            if len(rows) >= ResultCache.BATCH_SIZE:
+                cache.put_rows(fingerprint, rows)
+                rows = {}
+        cache.put_rows(fingerprint, rows)
+
+# Function to write a dataset TSV for all input records from cached rows, in input order
+def write_cached_tsv(cache, fingerprint, records, output_tsv):
+    header = cache.get_header(fingerprint)
+    with open(output_tsv, 'w', newline='') as handle:
+        writer = csv.writer(handle, delimiter='\t', lineterminator='\n')
+        writer.writerow(header)
+        for start in range(0, len(records), ResultCache.BATCH_SIZE):
+            batch = records[start:start + ResultCache.BATCH_SIZE]
+            rows = cache.get_rows(fingerprint, [seq_hash for _, seq_hash in batch])
+            for offset, (name, seq_hash) in enumerate(batch):
+                row = rows[seq_hash]
+                values = {'index': str(start + offset), 'seqName': name}
+                writer.writerow([values[column] if column in values else row.get(column, '') for column in header])
+
+# Function to report the Nextclade version so cached rows are not reused across versions
+def nextclade_version(nextclade):
+    try:
+        result = subprocess.run([nextclade, '--version'], capture_output=True, text=True)
+    except OSError:
+        return ''
+    return result.stdout.strip() if result.returncode == 0 else ''
+
+# Function to run Nextclade only on sequences missing from the result cache and rebuild every dataset TSV from it
+def run_with_cache(args, dataset_dirs, fasta_files, work_dir):
+    cache = ResultCache(args.cache)
+    version = nextclade_version(args.nextclade)
+    fingerprints = {os.path.basename(d): dataset_fingerprint(d, version) for d in dataset_dirs}
+
+    records = hash_fasta_records(fasta_files)
+    missing_by_dataset = {name: cache.missing(fingerprint, [seq_hash for _, seq_hash in records]) for name, fingerprint in fingerprints.items()}
+    for name, missing in missing_by_dataset.items():
+        n_cached = sum(1 for _, seq_hash in records if seq_hash not in missing)
+        print(f"Dataset {name}: {n_cached} of {len(records)} sequences cached, {len(missing)} unique sequences to run")
+
+    missing_fasta = write_missing_fasta(fasta_files, missing_by_dataset, work_dir)
+    dataset_inputs = {name: (os.path.join(args.nextclade_datasets, name), [path]) for name, path in missing_fasta.items()}
+    fresh_paths = {name: os.path.join(work_dir, f"{name}_fresh.tsv") for name in dataset_inputs}
+
+    if dataset_inputs and not run_datasets(dataset_inputs, fresh_paths, work_dir, args.nextclade, args.cpus, args.shard_size):
+        cache.close()
+        return False
+
+    for name, fingerprint in fingerprints.items():
+        if name in fresh_paths:
+            store_nextclade_rows(cache, fingerprint, fresh_paths[name])
+        write_cached_tsv(cache, fingerprint, records, os.path.join(args.output_dir, f"{name}.tsv"))
+
+    deleted = cache.evict(int(args.cache_max_mb * 1024 * 1024))
+    if deleted:
+        print(f"Evicted {deleted} entries from the result cache")
+    cache.close()
+    return True
+
+def main():
+    args = parse_arguments()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    dataset_dirs = sorted(
+        os.path.join(args.nextclade_datasets, name) for name in os.listdir(args.nextclade_datasets)
+        if os.path.isdir(os.path.join(args.nextclade_datasets, name))
+    )
+    fasta_files = sorted(glob.glob(os.path.join(args.fasta_dir, '*.fasta')))
+    if not dataset_dirs:
+        print(f"Error: No Nextclade datasets found in '{args.nextclade_datasets}'", file=sys.stderr)
+        sys.exit(1)
+    if not fasta_files:
+        print(f"Error: No FASTA files found in '{args.fasta_dir}'", file=sys.stderr)
+        sys.exit(1)
+
+    work_dir = os.path.join(args.output_dir, '.nextclade_work')
+    if args.cache:
+        succeeded = run_with_cache(args, dataset_dirs, fasta_files, work_dir)
+    else:
+        dataset_inputs = {os.path.basename(d): (d, fasta_files) for d in dataset_dirs}
+        output_paths = {name: os.path.join(args.output_dir, f"{name}.tsv") for name in dataset_inputs}
+        succeeded = run_datasets(dataset_inputs, output_paths, work_dir, args.nextclade, args.cpus, args.shard_size)
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    if not succeeded:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import sys
+import csv
+import json
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+# Nextclade columns sent to the screening service
+REQUEST_COLUMNS = ['seqName', 'aaSubstitutions', 'aaDeletions', 'aaInsertions', 'alignmentStart', 'alignmentEnd', 'missing']
+SUMMARY_COLUMNS = ['Sequence_ID', 'All_Mutations', 'Curated_Mutations', 'Inferred_Mutations', 'Combination_Present']
+FREQUENCY_COLUMNS = ['Mutation/Combination', 'Count', 'Type', 'Frequency']
+MUTATION_TYPES = ['Individual', 'Combination', 'Inferred']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Submit a Nextclade TSV to a running screen_server.py in concurrent batches.')
+    parser.add_argument('-i', '--input_file', required=True, help='Nextclade TSV file.')
+    parser.add_argument('-o', '--output_prefix', required=True, help='Prefix of the output tables; <prefix>_<panel>_summary.csv and _freq_summary.csv are written per panel.')
+    parser.add_argument('-u', '--url', default='http://127.0.0.1:8765', help='Screening service URL (default: http://127.0.0.1:8765).')
+    parser.add_argument('-p', '--panels', nargs='+', default=None, help='Panels to screen against (default: all served panels).')
+    parser.add_argument('-d', '--dataset', default=None, help='Nextclade dataset of the TSV, for coverage-aware inference.')
+    parser.add_argument('-b', '--batch_size', type=int, default=5000, help='Rows per request (default: 5000).')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Requests in flight at once (default: 4).')
+    parser.add_argument('--clean', action='store_true', help='Input is raw Nextclade output; let the service drop failed records.')
+    parser.add_argument('-f', '--filter_column', default='qc.overallScore', help='Column used by --clean to detect failed records (default: qc.overallScore).')
+    return parser.parse_args()
+
+class ScreeningClient:
+    """
+    Minimal asyncio HTTP client for screen_server.py, using one connection per request.
+    """
+
+    def __init__(self, url='http://127.0.0.1:8765'):
+        parts = urlsplit(url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+
+    async def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(
+                f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+        head, _, content = response.partition(b'\r\n\r\n')
+        status = int(head.split(b' ', 2)[1])
+        result = json.loads(content or b'{}')
+        if status != 200:
+            raise RuntimeError(f"ERROR: Screening service returned {status}: {result.get('error', content.decode(errors='replace'))}")
+        return result
+
+    async def health(self):
+        return await self.request('GET', '/health')
+
+    async def screen(self, rows, panels=None, dataset=None, clean=False, filter_column=None):
+        payload = {'rows': rows, 'panels': panels, 'dataset': dataset, 'clean': clean}
+        if filter_column:
+            payload['filter_column'] = filter_column
+        return await self.request('POST', '/screen', payload)
+
+    async def screen_batches(self, batches, panels=None, dataset=None, clean=False, filter_column=None, jobs=4):
+        """
+        Screen batches with at most jobs requests in flight; results are returned in batch order.
+        """
+        semaphore = asyncio.Semaphore(jobs)
+
+        async def screen_one(rows):
+            async with semaphore:
+                return await self.screen(rows, panels, dataset, clean, filter_column)
+
+        return await asyncio.gather(*(screen_one(rows) for rows in batches))
+
+# Function to read a Nextclade TSV into batches of row objects with only the columns the service uses
+def read_batches(input_file, batch_size, extra_columns=()):
+    columns = set(REQUEST_COLUMNS) | set(extra_columns)
+    batch = []
+    with open(input_file, newline='') as handle:
+        for row in csv.DictReader(handle, delimiter='\t'):
+            batch.append({column: value for column, value in row.items() if column in columns})
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# Function to write the summary and frequency tables of each panel from the batch responses
+def write_results(responses, output_prefix):
+    n_sequences = sum(response['n_sequences'] for response in responses)
+    panels = list(responses[0]['results']) if responses else []
+    for panel in panels:
+        with open(f"{output_prefix}_{panel}_summary.csv", 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=SUMMARY_COLUMNS, lineterminator='\n')
+            writer.writeheader()
+            for response in responses:
+                writer.writerows(response['results'][panel]['summary'])
+
+        # Add up the counts of all batches, keeping first-seen order
+        totals = {mutation_type: {} for mutation_type in MUTATION_TYPES}
+        for response in responses:
+            for mutation_type, counts in response['results'][panel]['counts'].items():
+                for label, count in counts:
+                    totals[mutation_type][label] = totals[mutation_type].get(label, 0) + count
+
+        with open(f"{output_prefix}_{panel}_freq_summary.csv", 'w', newline='') as handle:
+            writer = csv.writer(handle, lineterminator='\n')
+            writer.writerow(FREQUENCY_COLUMNS)
+            for mutation_type in MUTATION_TYPES:
+                for label, count in totals[mutation_type].items():
+                    writer.writerow([label, count, mutation_type, count / n_sequences if n_sequences else float('nan')])
+        print(f"Results for panel {panel} saved to {output_prefix}_{panel}_summary.csv and {output_prefix}_{panel}_freq_summary.csv")
+
+async def run(args):
+    client = ScreeningClient(args.url)
+    await client.health()
+    batches = list(read_batches(args.input_file, args.batch_size, [args.filter_column] if args.clean else []))
+    responses = await client.screen_batches(batches, args.panels, args.dataset, args.clean, args.filter_column if args.clean else None, args.jobs)
+    elapsed = sum(response['elapsed_ms'] for response in responses)
+    print(f"Screened {sum(response['n_sequences'] for response in responses)} sequences in {len(batches)} batches ({elapsed:.1f} ms of service time)")
+    write_results(responses, args.output_prefix)
+
+def main():
+    args = parse_arguments()
+    try:
+        asyncio.run(run(args))
+    except (OSError, RuntimeError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mutation_panel import drop_shadowed_panels, mutation_list_name
+from mutation_screen import (
+    FILTER_COLUMN, MUTATION_COLUMNS, PANEL_SUFFIX, build_inferred_mutations, clean_dataframe, count_frequencies,
+    load_curated_mutations, load_gene_map, load_mutation_panel, parse_sequences, screen_panel
+)
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_BYTES = 256 * 1024 * 1024
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Serve mutation screening over localhost HTTP with the mutation lists and Nextclade datasets kept in memory.')
+    parser.add_argument('-m', '--mutations', required=True, help='Mutation list CSV or compiled panel, or a directory of them; each is served under its file name without extension.')
+    parser.add_argument('-d', '--nextclade_datasets', default=None, help='Directory of Nextclade datasets whose annotations are used for coverage-aware inference.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1).')
+    parser.add_argument('-p', '--port', type=int, default=8765, help='Port to listen on (default: 8765; 0 picks a free port).')
+    return parser.parse_args()
+
+# Function to list the mutation lists to serve by name (see mutation_panel.drop_shadowed_panels)
+def find_mutation_files(mutations):
+    if not os.path.isdir(mutations):
+        return {mutation_list_name(mutations): mutations}
+    files = {}
+    for file in drop_shadowed_panels(sorted(os.listdir(mutations))):
+        if file.endswith(('.csv', PANEL_SUFFIX)):
+            files[mutation_list_name(file)] = os.path.join(mutations, file)
+    if not files:
+        raise FileNotFoundError(f"ERROR: No CSV files found in mutation directory '{mutations}'.")
+    return files
+
+class ScreeningService:
+    """
+    Screens batches of Nextclade rows against mutation lists held in memory.
+
+    The curated mutations, their inferred sites and the gene maps of the
+    Nextclade datasets are loaded once; each batch is parsed once
+    (parse_sequences) and evaluated against every requested panel
+    (screen_panel), giving the same columns and counts as mutation_screen.py.
+    """
+
+    def __init__(self, mutations, nextclade_datasets=None):
+        self.panels = {}
+        for name, mutation_file in find_mutation_files(mutations).items():
+            curated_mutations = load_curated_mutations(mutation_file)
+            self.panels[name] = {
+                'source': os.path.basename(mutation_file),
+                'panel_id': load_mutation_panel(mutation_file)['panel_id'] if mutation_file.endswith(PANEL_SUFFIX) else None,
+                'curated_mutations': curated_mutations,
+                'inferred_mutations': build_inferred_mutations(curated_mutations[0]),
+            }
+
+        self.gene_maps = {}
+        if nextclade_datasets:
+            for name in sorted(os.listdir(nextclade_datasets)):
+                if os.path.isdir(os.path.join(nextclade_datasets, name)):
+                    self.gene_maps[name] = load_gene_map(os.path.join(nextclade_datasets, name))
+
+    def describe(self):
+        return {
+            'panels': {
+                name: {
+                    'source': panel['source'],
+                    'panel_id': panel['panel_id'],
+                    'individual_mutations': len(panel['curated_mutations'][0]),
+                    'combinations': len(panel['curated_mutations'][1]),
+                }
+                for name, panel in self.panels.items()
+            },
+            'datasets': list(self.gene_maps),
+        }
+
+    # Function to build the Nextclade table of a request from its rows or TSV text
+    def read_batch(self, request):
+        if 'tsv' in request:
+            df = pd.read_csv(io.StringIO(request['tsv']), sep='\t', dtype=str)
+        else:
+            df = pd.DataFrame.from_records(request.get('rows', []))
+        if df.empty:
+            df = pd.DataFrame(columns=['seqName', *MUTATION_COLUMNS])
+        if 'seqName' not in df.columns:
+            raise ValueError("Rows must contain a 'seqName' column.")
+        for column in MUTATION_COLUMNS:
+            if column not in df.columns:
+                df[column] = ''
+        if request.get('clean'):
+            df = clean_dataframe(df, request.get('filter_column', FILTER_COLUMN)).reset_index(drop=True)
+        return df
+
+    def screen(self, request):
+        """
+        Screen one batch. request holds 'rows' (list of Nextclade row objects)
+        or 'tsv' (Nextclade TSV text), and optionally 'panels' (default: all),
+        'dataset' (enables coverage-aware inference), 'clean' and
+        'filter_column'. Returns per-panel summary rows and frequency counts.
+        """
+        start = time.perf_counter()
+        panel_names = request.get('panels') or list(self.panels)
+        unknown = [name for name in panel_names if name not in self.panels]
+        if unknown:
+            raise ValueError(f"Unknown panels: {', '.join(unknown)}. Available: {', '.join(self.panels)}")
+        dataset = request.get('dataset')
+        if dataset and dataset not in self.gene_maps:
+            raise ValueError(f"Unknown dataset '{dataset}'. Available: {', '.join(self.gene_maps)}")
+        gene_map = self.gene_maps.get(dataset) if dataset else None
+
+        df = self.read_batch(request)
+        parsed = parse_sequences(df, gene_map)
+        sequence_ids = df['seqName'].tolist()
+        all_mutations = parsed['all_mutations'].tolist()
+
+        results = {}
+        for name in panel_names:
+            panel = self.panels[name]
+            columns, screen_result = screen_panel(parsed, *panel['curated_mutations'], panel['inferred_mutations'], gene_map)
+            summary = [
+                {'Sequence_ID': sequence_id, 'All_Mutations': mutations, 'Curated_Mutations': curated, 'Inferred_Mutations': inferred, 'Combination_Present': combination}
+                for sequence_id, mutations, curated, inferred, combination in zip(
+                    sequence_ids, all_mutations, columns['Curated_Mutations'].tolist(),
+                    columns['Inferred_Mutations'].tolist(), columns['Combination_Present'].tolist()
+                )
+            ]
+            counts = {
+                mutation_type: [[str(label), int(count)] for label, count in zip(labels, counts)]
+                for mutation_type, (labels, counts) in count_frequencies(screen_result).items()
+            }
+            results[name] = {'summary': summary, 'counts': counts}
+
+        return {
+            'n_sequences': parsed['n_sequences'],
+            'dataset': dataset,
+            'results': results,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+        }
+
+class ScreeningHandler(BaseHTTPRequestHandler):
+    """
+    GET /health and GET /panels describe the service; POST /screen takes a
+    JSON batch (see ScreeningService.screen) and returns JSON. Errors are
+    returned as {"error": message} with status 400 or 500.
+    """
+
+    service = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'panels': list(self.service.panels), 'datasets': list(self.service.gene_maps)})
+        elif self.path == '/panels':
+            self.send_json(200, self.service.describe())
+        else:
+            self.send_json(404, {'error': f"Unknown path '{self.path}'"})
+
+    def do_POST(self):
+        if self.path != '/screen':
+            self.send_json(404, {'error': f"Unknown path '{self.path}'"})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            self.send_json(413, {'error': f"Request body exceeds {MAX_REQUEST_BYTES} bytes; send smaller batches."})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("Request body must be a JSON object.")
+            self.send_json(200, self.service.screen(request))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+def main():
+    args = parse_arguments()
+    try:
+        load_start = time.perf_counter()
+        service = ScreeningService(args.mutations, args.nextclade_datasets)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    ScreeningHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), ScreeningHandler)
+    host, port = server.server_address[:2]
+    print(f"Loaded {len(service.panels)} mutation lists and {len(service.gene_maps)} Nextclade datasets in {time.perf_counter() - load_start:.2f} s")
+    print(f"Screening service listening on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import os
+import pandas as pd
+
+# Formats supported for the tables handed between pipeline stages
+INTERMEDIATE_FORMATS = ['csv', 'parquet']
+
+def require_pyarrow():
+    """
+    Import pyarrow for Parquet support, raising a clear error if it is not installed.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("ERROR: The 'parquet' intermediate format requires the pyarrow package.")
+    return pyarrow
+
+# Function to tell whether a path holds a Parquet table
+def is_parquet(path):
+    return path.endswith('.parquet')
+
+# Function to list the column names of a delimited or Parquet table without reading its rows
+def read_columns(path, sep=','):
+    if is_parquet(path):
+        pa = require_pyarrow()
+        return list(pa.parquet.read_schema(path).names)
+    return list(pd.read_csv(path, sep=sep, nrows=0).columns)
+
+# Function to read a delimited or Parquet table, optionally as an iterator of chunks
+def read_table(path, sep=',', columns=None, chunk_size=None, **csv_kwargs):
+    if is_parquet(path):
+        pa = require_pyarrow()
+        if chunk_size:
+            parquet_file = pa.parquet.ParquetFile(path)
+            return (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns))
+        return pd.read_parquet(path, columns=columns)
+
+    return pd.read_csv(path, sep=sep, usecols=columns, chunksize=chunk_size, **csv_kwargs)
+
+class TableWriter:
+    """
+    Write a table to CSV/TSV or Parquet one chunk at a time.
+
+    The first chunk creates the file (and, for Parquet, fixes the schema,
+    with columns empty in that chunk typed as strings); later chunks are
+    appended. Parquet string columns are dictionary-encoded.
+    """
+
+    def __init__(self, path, sep=','):
+        self.path = path
+        self.sep = sep
+        self.rows = 0
+        self.chunks = 0
+        self._writer = None
+        self._schema = None
+
+    def write(self, df):
+        if is_parquet(self.path):
+            pa = require_pyarrow()
+            if self._writer is None:
+                # A column empty throughout the first chunk is inferred as null; type it as string so later values fit
+                schema = pa.Table.from_pandas(df, preserve_index=False).schema
+                self._schema = pa.schema(
+                    [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema], metadata=schema.metadata
+                )
+                self._writer = pa.parquet.ParquetWriter(self.path, self._schema, use_dictionary=True)
+            self._writer.write_table(pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
+        else:
+            df.to_csv(self.path, sep=self.sep, index=False, mode='a' if self.chunks else 'w', header=not self.chunks)
+        self.chunks += 1
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Function to build an output path with the extension for the chosen format
+def table_path(prefix, output_format='csv', sep=','):
+    if output_format == 'parquet':
+        return f"{prefix}.parquet"
+    return f"{prefix}.tsv" if sep == '\t' else f"{prefix}.csv"
+
+# Function to strip a table suffix such as '_summary' plus its extension from a file name
+def strip_table_suffix(filename, suffix):
+    for extension in ('.csv', '.parquet'):
+        if filename.endswith(f"{suffix}{extension}"):
+            return os.path.basename(filename)[:-len(f"{suffix}{extension}")]
+    return None
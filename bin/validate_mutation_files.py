@@ -4,6 +4,27 @@ import os
 import sys
 import pandas as pd
 
+REQUIRED_COLUMNS = {'Gene', 'AminoAcid', 'Combination', 'Reason_for_Inclusion'}
+
+
+def validate_mutations_df(df, file_path):
+    """
+    Validate the contents of one mutation list.
+
+    Raises:
+    - ValueError: If required columns are missing or there are no data rows.
+    """
+    # Validate header
+    if not REQUIRED_COLUMNS.issubset(df.columns):
+        raise ValueError(
+            f"ERROR: File '{file_path}' is missing required columns. "
+            f"Expected columns: {REQUIRED_COLUMNS}, Found: {set(df.columns)}"
+        )
+
+    # Check for non-header rows
+    if df.shape[0] == 0:
+        raise ValueError(f"ERROR: File '{file_path}' contains only a header and no data.")
+
 
 def validate_mutation_files(mutation_dir):
     """
@@ -31,17 +52,7 @@ def validate_mutation_files(mutation_dir):
         except Exception as e:
             raise ValueError(f"ERROR: Failed to read file '{file_path}'. Reason: {e}")
 
-        # Validate header
-        expected_columns = {'Gene', 'AminoAcid', 'Combination', 'Reason_for_Inclusion'}
-        if not expected_columns.issubset(df.columns):
-            raise ValueError(
-                f"ERROR: File '{file_path}' is missing required columns. "
-                f"Expected columns: {expected_columns}, Found: {set(df.columns)}"
-            )
-
-        # Check for non-header rows
-        if df.shape[0] == 0:
-            raise ValueError(f"ERROR: File '{file_path}' contains only a header and no data.")
+        validate_mutations_df(df, file_path)
         print(f"File '{file}' passed validation.")  # Optional for debugging purposes
 
 
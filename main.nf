@@ -34,11 +34,16 @@ workflow {
     // Run Nextclade
     NEXTCLADE_RUN(DATA_PREPARATION.out.fasta_files)
 
-    // Clean TSV Files from Nextclade
-    CLEAN_TSV_FILES(NEXTCLADE_RUN.out.nextclade_outputs)
+    // Clean TSV Files from Nextclade (otherwise failed records are dropped during mutation analysis)
+    if (params.save_cleaned_tsv) {
+        CLEAN_TSV_FILES(NEXTCLADE_RUN.out.nextclade_outputs)
+        ch_tsv_files = CLEAN_TSV_FILES.out.cleaned_tsv_files
+    } else {
+        ch_tsv_files = NEXTCLADE_RUN.out.nextclade_outputs
+    }
 
     //Run Mutation Analysis
-    MUTATION_ANALYSIS(CLEAN_TSV_FILES.out.cleaned_tsv_files, Channel.fromPath(params.mutations_csv, checkIfExists: true))
+    MUTATION_ANALYSIS(ch_tsv_files, Channel.fromPath(params.mutations_csv, checkIfExists: true), DATA_PREPARATION.out.sequence_map)
 
     // Combine Results
     DATA_COMPILATION(MUTATION_ANALYSIS.out.mutation_results)
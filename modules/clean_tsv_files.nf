@@ -15,13 +15,17 @@ process CLEAN_TSV_FILES {
 
     output:
     path ('cleaned_tsv'), emit: cleaned_tsv_files
+    path ('*.metrics.json'), emit: metrics
+    path ('*.prof'), optional: true, emit: profiles
 
-    publishDir "${params.output_dir}", mode: 'copy'
+    publishDir "${params.output_dir}", mode: 'copy', pattern: 'cleaned_tsv'
+    publishDir "${params.tracedir}/metrics", mode: 'copy', pattern: '*.{metrics.json,prof}'
 
     script:
+    def metrics_args = "--metrics clean_tsv_files.metrics.json" + (params.profile_python ? " --profile clean_tsv_files.prof" : '')
     """
     mkdir -p cleaned_tsv
 
-    clean_tsv.py ${nextclade_outputs} cleaned_tsv
+    clean_tsv.py ${nextclade_outputs} cleaned_tsv -c ${params.tsv_chunk_size} --output_format ${params.intermediate_format} ${metrics_args}
     """
 }
\ No newline at end of file
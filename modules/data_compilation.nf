@@ -13,14 +13,24 @@ process DATA_COMPILATION {
     path mutation_results
 
     output:
-    path ('combined_results'), emit: combined_results_dir 
+    path ('combined_results'), emit: combined_results_dir
+    path ('*.metrics.json'), emit: metrics
+    path ('*.prof'), optional: true, emit: profiles
     
-    publishDir "${params.output_dir}", mode: 'copy'
+    publishDir "${params.output_dir}", mode: 'copy', pattern: 'combined_results'
+    publishDir "${params.tracedir}/metrics", mode: 'copy', pattern: '*.{metrics.json,prof}'
 
     script:
+    def metrics_args = "--metrics data_compilation.metrics.json" + (params.profile_python ? " --profile data_compilation.prof" : '')
+    def compress_flag = params.compress_combined ? '-z' : ''
+    // With a checkpoint directory, only the sections of changed per-dataset tables are rebuilt
+    def results_dir = params.checkpoint_dir ? "${params.checkpoint_dir}/combined_results" : 'combined_results'
+    def resume_flag = params.checkpoint_dir ? '--resume' : ''
+    def link_results = params.checkpoint_dir ? "ln -sfn ${results_dir} combined_results" : ''
     """
-    mkdir -p combined_results
+    mkdir -p ${results_dir}
 
-    combine_csv_outputs.py -i ${mutation_results} -o combined_results
+    combine_csv_outputs.py -i ${mutation_results} -o ${results_dir} -c ${params.tsv_chunk_size} ${compress_flag} ${resume_flag} ${metrics_args}
+    ${link_results}
     """
 }
\ No newline at end of file
@@ -13,14 +13,20 @@ process DATA_PREPARATION {
 
     output:
     path ('Mutation_Scan'), emit: fasta_files
+    path ('Mutation_Scan/sequence_map.tsv'), emit: sequence_map
+    path ('*.metrics.json'), emit: metrics
+    path ('*.prof'), optional: true, emit: profiles
 
-    publishDir "${params.output_dir}", mode: 'copy'
+    publishDir "${params.output_dir}", mode: 'copy', pattern: 'Mutation_Scan'
+    publishDir "${params.tracedir}/metrics", mode: 'copy', pattern: '*.{metrics.json,prof}'
 
     script:
+    def metrics_args = "--metrics data_preparation.metrics.json" + (params.profile_python ? " --profile data_preparation.prof" : '')
+    def dedup_flag = params.dedup_sequences ? '--dedup' : ''
     """
     mkdir -p Mutation_Scan
     
-    data_preparation.py -i ${input_dir} -o Mutation_Scan > data_preparation.log 2>&1 || \
+    data_preparation.py -i ${input_dir} -o Mutation_Scan ${dedup_flag} ${metrics_args} > data_preparation.log 2>&1 || \
         { echo "ERROR: Data preparation failed. Check data_preparation.log for details."; exit 1; }
     """
 }
\ No newline at end of file
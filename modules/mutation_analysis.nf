@@ -10,25 +10,46 @@ process MUTATION_ANALYSIS {
 
 
     input:
-    path cleaned_tsv_files
+    path tsv_files
     path mutations_dir
+    path sequence_map
 
     output:
     path 'mutation_results', emit: mutation_results
+    path ('*.metrics.json'), emit: metrics
+    path ('*.prof'), optional: true, emit: profiles
 
-    publishDir "${params.output_dir}", mode: 'copy'
+    publishDir "${params.output_dir}", mode: 'copy', pattern: 'mutation_results'
+    publishDir "${params.tracedir}/metrics", mode: 'copy', pattern: '*.{metrics.json,prof}'
 
     script:
+    def metrics_args = "--metrics mutation_analysis.metrics.json" + (params.profile_python ? " --profile mutation_analysis.prof" : '')
+    def clean_flag = params.save_cleaned_tsv ? '' : '--clean'
+    def coverage_flag = params.coverage_aware_inference ? '' : '--ignore_coverage'
+    // With a checkpoint directory, results persist across runs and only changed datasets are screened again
+    def results_dir = params.checkpoint_dir ? "${params.checkpoint_dir}/mutation_results" : 'mutation_results'
+    def resume_flag = params.checkpoint_dir ? '--resume' : ''
+    def link_results = params.checkpoint_dir ? "ln -sfn ${results_dir} mutation_results" : ''
     """
-    mkdir -p mutation_results
+    mkdir -p ${results_dir}
 
-    validate_mutation_files.py ${mutations_dir} || exit 1
+    # Validate and compile each mutation list once; every dataset then loads its panel directly
+    mutation_panel.py compile -m ${mutations_dir} -o mutation_panels || exit 1
 
     run_mutation_analysis.py \\
-        -t ${cleaned_tsv_files} \\
-        -m ${mutations_dir} \\
+        -t ${tsv_files} \\
+        -m mutation_panels \\
         -d ${params.nextclade_datasets}\\
         -s ${params.mutation_script} \\
-        -o mutation_results
+        -j ${task.cpus} \\
+        -c ${params.tsv_chunk_size} \\
+        ${clean_flag} \\
+        ${coverage_flag} \\
+        --output_format ${params.intermediate_format} \\
+        --sequence_map ${sequence_map} \\
+        -o ${results_dir} \\
+        ${resume_flag} \\
+        ${metrics_args}
+    ${link_results}
     """
 }
\ No newline at end of file
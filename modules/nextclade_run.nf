@@ -1,11 +1,11 @@
 process NEXTCLADE_RUN {
     tag 'Nextclade Analysis'
 
-    conda 'bioconda::nextclade==3.9.1--h9ee0642_0'  // Adjust the version as needed
+    conda 'bioconda::nextclade==3.9.1--h9ee0642_0 conda-forge::python>=3.8'  // Adjust the version as needed
     if (workflow.containerEngine == 'singularity' && !params.singularity_pull_docker_container) {
-        container 'https://depot.galaxyproject.org/singularity/nextclade:3.9.1--h9ee0642_0'
+        container 'https://depot.galaxyproject.org/singularity/mulled-v2-66b362d739f0e38fa18ec4e6de396a7010a16241:4c1bb3ae3f07d8cb72f676b27df368e9b2537451-0'
     } else {
-        container 'quay.io/biocontainers/nextclade:3.9.1--h9ee0642_0'
+        container 'quay.io/biocontainers/mulled-v2-66b362d739f0e38fa18ec4e6de396a7010a16241:4c1bb3ae3f07d8cb72f676b27df368e9b2537451-0'
     }
 
     input:
@@ -15,18 +15,18 @@ process NEXTCLADE_RUN {
     path ('nextclade_outputs'), emit: nextclade_outputs
 
     publishDir "${params.output_dir}", mode: 'copy'
-    //*TODO: MAKE THIS A PYTHON SCRIPT
+
     script:
+    def cache_args = params.result_cache ? "--cache ${params.result_cache} --cache_max_mb ${params.result_cache_max_mb}" : ''
     """
     mkdir -p nextclade_outputs
 
-    for dataset in ${params.nextclade_datasets}/*; do
-        dataset_name=\$(basename \${dataset})
-        echo "Running Nextclade on dataset: \${dataset_name}"
-        nextclade run \
-            ${fasta_files}/*.fasta \
-            --output-tsv nextclade_outputs/\${dataset_name}.tsv \
-            --input-dataset \${dataset}
-    done
+    run_nextclade.py \\
+        -i ${fasta_files} \\
+        -d ${params.nextclade_datasets} \\
+        -o nextclade_outputs \\
+        -c ${task.cpus} \\
+        -s ${params.nextclade_shard_size} \\
+        ${cache_args}
     """
 }
\ No newline at end of file
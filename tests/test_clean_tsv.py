@@ -0,0 +1,23 @@
+import pytest
+from clean_tsv import clean_tsv_file
+
+NEXTCLADE_TSV = """\
+index\tseqName\tqc.overallScore\taaSubstitutions\terrors
+0\ts1\t12\tHA:Q187T\t
+1\ts2\t\t\tUnable to align
+2\ts3\t3\t\t
+"""
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_clean_drops_failed_records(tmp_path, chunk_size):
+    (tmp_path / 'input.tsv').write_text(NEXTCLADE_TSV)
+    clean_tsv_file(str(tmp_path / 'input.tsv'), str(tmp_path / 'output.tsv'), chunk_size)
+    lines = NEXTCLADE_TSV.splitlines(keepends=True)
+    assert (tmp_path / 'output.tsv').read_text() == lines[0] + lines[1] + lines[3]
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_header_only_input_writes_nothing(tmp_path, capsys, chunk_size):
+    (tmp_path / 'input.tsv').write_text(NEXTCLADE_TSV.splitlines(keepends=True)[0])
+    clean_tsv_file(str(tmp_path / 'input.tsv'), str(tmp_path / 'output.tsv'), chunk_size)
+    assert not (tmp_path / 'output.tsv').exists()
+    assert 'is empty' in capsys.readouterr().out
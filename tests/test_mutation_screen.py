@@ -0,0 +1,130 @@
+import os
+import csv
+import pytest
+from mutation_screen import codon_span, load_curated_mutations, load_gene_map, load_sequence_map, process_file
+
+DATASETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'nextclade_datasets')
+
+MUTATIONS_CSV = """\
+Gene,AminoAcid,Combination,Reason_for_Inclusion
+HA,Q187T,No,test
+HA,Q279X,No,test
+HA,T215I,No,test
+HA,K100-,No,test
+HA,Q187T+T215T,Yes,test
+"""
+
+TSV_HEADER = "seqName\taaSubstitutions\taaDeletions\taaInsertions\n"
+
+# s1 repeats a token and needs the inferred HA:T215T for its combination; s2 has a wildcard match and a deletion; s3 an insertion
+NEXTCLADE_TSV = TSV_HEADER + """\
+s1\tHA:Q187T,HA:Q187T\t\t
+s2\tHA:Q279R,HA:T215I\tHA:K100-\t
+s3\tHA:N38C\t\tHA:50:KK
+"""
+
+# Tables written by the original row-by-row implementation for the input above
+EXPECTED_SUMMARY = """\
+Sequence_ID,All_Mutations,Curated_Mutations,Inferred_Mutations,Combination_Present
+s1,"HA:Q187T,HA:Q187T","HA:Q187T, HA:Q187T","HA:Q279Q, HA:T215T, HA:K100K",Q187T+T215T
+s2,"HA:Q279R,HA:T215I,HA:K100-","HA:Q279R, HA:T215I",HA:Q187Q,
+s3,"HA:N38C,HA:50:KK",,"HA:Q187Q, HA:Q279Q, HA:T215T, HA:K100K",
+"""
+
+EXPECTED_FREQ_SUMMARY = """\
+Mutation/Combination,Count,Type,Frequency
+HA:Q187T,2,Individual,0.6666666666666666
+HA:Q279R,1,Individual,0.3333333333333333
+HA:T215I,1,Individual,0.3333333333333333
+HA:K100-,1,Individual,0.3333333333333333
+HA:N38C,1,Individual,0.3333333333333333
+HA:50:KK,1,Individual,0.3333333333333333
+Q187T+T215T,1,Combination,0.3333333333333333
+HA:Q279Q,2,Inferred,0.6666666666666666
+HA:T215T,2,Inferred,0.6666666666666666
+HA:K100K,2,Inferred,0.6666666666666666
+HA:Q187Q,2,Inferred,0.6666666666666666
+"""
+
+def screen(tmp_path, tsv, chunk_size, sequence_map=None, mutations_csv=MUTATIONS_CSV, gene_map=None):
+    (tmp_path / 'mutations.csv').write_text(mutations_csv)
+    (tmp_path / 'input.tsv').write_text(tsv)
+    output_prefix = str(tmp_path / 'out')
+    process_file(str(tmp_path / 'input.tsv'), output_prefix, *load_curated_mutations(str(tmp_path / 'mutations.csv')), chunk_size=chunk_size,
+                 sequence_map=sequence_map, gene_map=gene_map)
+    return (tmp_path / 'out_summary.csv').read_text(), (tmp_path / 'out_freq_summary.csv').read_text()
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 2])
+def test_tables_match_original_implementation(tmp_path, chunk_size):
+    summary, freq_summary = screen(tmp_path, NEXTCLADE_TSV, chunk_size)
+    assert summary == EXPECTED_SUMMARY
+    assert freq_summary == EXPECTED_FREQ_SUMMARY
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_header_only_input(tmp_path, chunk_size):
+    summary, freq_summary = screen(tmp_path, TSV_HEADER, chunk_size)
+    assert summary == EXPECTED_SUMMARY.splitlines(keepends=True)[0]
+    assert freq_summary == EXPECTED_FREQ_SUMMARY.splitlines(keepends=True)[0]
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_numeric_sequence_ids_expand_from_sequence_map(tmp_path, chunk_size):
+    # 003 was collapsed into 001 before Nextclade; IDs must stay strings for the map to match
+    (tmp_path / 'sequence_map.tsv').write_text("seqName\trepresentative\n003\t001\n")
+    tsv = TSV_HEADER + "001\tHA:Q187T\t\t\n002\tHA:T215I\t\t\n"
+    summary, freq_summary = screen(tmp_path, tsv, chunk_size, load_sequence_map(str(tmp_path / 'sequence_map.tsv')))
+    assert [line.split(',', 1)[0] for line in summary.splitlines()[1:]] == ['001', '003', '002']
+    assert 'HA:Q187T,2,Individual,0.6666666666666666' in freq_summary.splitlines()
+
+# Function to read the Inferred_Mutations of each sequence from a summary table
+def inferred_by_sequence(summary):
+    return {row['Sequence_ID']: row['Inferred_Mutations'] for row in csv.DictReader(summary.splitlines())}
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_uncovered_codons_are_not_inferred(tmp_path, chunk_size):
+    # HA codon 187 is reference nucleotides 628-630 in the H5_HA annotation (HA CDS 70-1728)
+    tsv = (
+        "seqName\taaSubstitutions\taaDeletions\taaInsertions\talignmentStart\talignmentEnd\tmissing\n"
+        "covered\tHA:N38C\t\t\t1\t1760\t\n"
+        "starts_after\tHA:N38C\t\t\t631\t1760\t\n"
+        "ends_before\tHA:N38C\t\t\t1\t629\t\n"
+        "masked\tHA:N38C\t\t\t1\t1760\t100-120,629\n"
+    )
+    mutations_csv = "Gene,AminoAcid,Combination,Reason_for_Inclusion\nHA,Q187T,No,test\nHA,T215I,No,test\n"
+    summary, _ = screen(tmp_path, tsv, chunk_size, mutations_csv=mutations_csv, gene_map=load_gene_map(os.path.join(DATASETS, 'H5_HA')))
+    assert inferred_by_sequence(summary) == {
+        'covered': 'HA:Q187Q, HA:T215T',
+        'starts_after': 'HA:T215T',
+        'ends_before': '',
+        'masked': 'HA:T215T',
+    }
+
+def test_inference_is_keyed_on_gene_and_codon(tmp_path):
+    mutations_csv = "Gene,AminoAcid,Combination,Reason_for_Inclusion\nHA1,E75K,No,test\nHA2,E75K,No,test\n"
+    tsv = TSV_HEADER + "s1\tHA2:E75K\t\t\ns2\tHA1:E75K\t\t\n"
+    summary, _ = screen(tmp_path, tsv, None, mutations_csv=mutations_csv)
+    # A change at HA2:75 must not hide the reference residue at HA1:75, and vice versa
+    assert inferred_by_sequence(summary) == {'s1': 'HA1:E75E', 's2': 'HA2:E75E'}
+
+def test_codon_span_multi_segment_plus_strand():
+    segments = [(10, 14), (20, 30)]
+    assert codon_span('+', segments, 1) == (10, 12)
+    # Codon 2 is the last two bases of the first segment and the first of the second
+    assert codon_span('+', segments, 2) == (13, 20)
+    assert codon_span('+', segments, 3) == (21, 23)
+    assert codon_span('+', segments, 6) is None
+    assert codon_span('+', segments, 0) is None
+
+def test_codon_span_minus_strand(tmp_path):
+    # Minus-strand CDS segments are read from the highest coordinate down
+    (tmp_path / 'genome_annotation.gff3').write_text(
+        "##gff-version 3\n"
+        "ref\tfeature\tCDS\t10\t20\t.\t-\t0\tName=NS2\n"
+        "ref\tfeature\tCDS\t41\t45\t.\t-\t0\tName=NS2\n"
+    )
+    gene_map = load_gene_map(str(tmp_path))
+    assert gene_map == {'NS2': ('-', [(41, 45), (10, 20)])}
+    strand, segments = gene_map['NS2']
+    assert codon_span(strand, segments, 1) == (43, 45)
+    assert codon_span(strand, segments, 2) == (20, 42)
+    assert codon_span(strand, segments, 3) == (17, 19)
+    assert codon_span(strand, segments, 6) is None
@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MUTATIONS_CSV = """\
+Gene,AminoAcid,Combination,Reason_for_Inclusion
+HA,Q187T,No,test
+HA,T215I,No,test
+"""
+
+NEXTCLADE_TSV = """\
+seqName\taaSubstitutions\taaDeletions\taaInsertions
+s1\tHA:Q187T\t\t
+s2\tHA:T215I\t\t
+"""
+
+@pytest.fixture
+def workspace(tmp_path):
+    # A copy of bin/ so the test can edit the modules the screening script imports
+    shutil.copytree(os.path.join(ROOT, 'bin'), tmp_path / 'bin', ignore=shutil.ignore_patterns('__pycache__'))
+    shutil.copytree(os.path.join(ROOT, 'resources', 'nextclade_datasets', 'H5_HA'), tmp_path / 'datasets' / 'H5_HA')
+    (tmp_path / 'tsv').mkdir()
+    (tmp_path / 'tsv' / 'H5_HA.tsv').write_text(NEXTCLADE_TSV)
+    (tmp_path / 'mutations').mkdir()
+    (tmp_path / 'mutations' / 'H5_HA.csv').write_text(MUTATIONS_CSV)
+    return tmp_path
+
+def run_resume(workspace):
+    bin_dir = workspace / 'bin'
+    cmd = [
+        sys.executable, str(bin_dir / 'run_mutation_analysis.py'), '-t', str(workspace / 'tsv'), '-m', str(workspace / 'mutations'),
+        '-d', str(workspace / 'datasets'), '-s', str(bin_dir / 'mutation_screen.py'), '-o', str(workspace / 'out'), '--resume'
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return 'Skipping H5_HA' in result.stdout
+
+def test_resume_skips_unchanged_datasets(workspace):
+    assert not run_resume(workspace)
+    assert (workspace / 'out' / 'H5_HA_summary.csv').exists()
+    assert run_resume(workspace)
+
+    (workspace / 'mutations' / 'H5_HA.csv').write_text(MUTATIONS_CSV + "HA,N38C,No,test\n")
+    assert not run_resume(workspace)
+
+@pytest.mark.parametrize('module', ['mutation_screen.py', 'table_io.py', 'clean_tsv.py'])
+def test_resume_reruns_after_screening_code_changes(workspace, module):
+    assert not run_resume(workspace)
+    with open(workspace / 'bin' / module, 'a') as handle:
+        handle.write('\n# changed\n')
+    assert not run_resume(workspace)
+    assert run_resume(workspace)
@@ -0,0 +1,123 @@
+import os
+import sys
+import subprocess
+import pytest
+
+RUN_NEXTCLADE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'run_nextclade.py')
+
+# Stand-in for the nextclade executable: one row per input record, derived from the record and the dataset
+# name; each run is logged, and a dataset holding a FAIL file makes the run fail
+STUB_NEXTCLADE = """\
+import os
+import sys
+
+if sys.argv[1] == '--version':
+    print('nextclade 0.0.0-stub')
+    sys.exit(0)
+
+args = sys.argv[2:]
+output_tsv = args[args.index('--output-tsv') + 1]
+dataset_dir = args[args.index('--input-dataset') + 1]
+input_files = args[:args.index('--output-tsv')]
+dataset = os.path.basename(dataset_dir)
+if os.path.exists(os.path.join(dataset_dir, 'FAIL')):
+    sys.exit(2)
+
+records = []
+for input_file in input_files:
+    for line in open(input_file):
+        if line.startswith('>'):
+            records.append([line[1:].strip(), ''])
+        else:
+            records[-1][1] += line.strip()
+with open(os.environ['STUB_LOG'], 'a') as log:
+    log.write(f"{dataset} {len(records)}\\n")
+with open(output_tsv, 'w') as out:
+    out.write('index\\tseqName\\tclade\\taaSubstitutions\\n')
+    for i, (name, sequence) in enumerate(records):
+        out.write(f"{i}\\t{name}\\t{dataset}\\tHA:A{len(sequence)}{sequence[0]}\\n")
+"""
+
+FASTA_FILES = {
+    'a.fasta': '>s1\nACGT\nAC\n>s2\nTTTTT\n',
+    'b.fasta': '>s3\nGGA\n>s4 duplicate of s1\nACGTAC\n',
+}
+
+def expected_tsv(dataset):
+    rows = [('s1', 'ACGTAC'), ('s2', 'TTTTT'), ('s3', 'GGA'), ('s4 duplicate of s1', 'ACGTAC')]
+    lines = ['index\tseqName\tclade\taaSubstitutions\n']
+    lines += [f"{i}\t{name}\t{dataset}\tHA:A{len(sequence)}{sequence[0]}\n" for i, (name, sequence) in enumerate(rows)]
+    return ''.join(lines)
+
+@pytest.fixture
+def workspace(tmp_path):
+    stub = tmp_path / 'nextclade'
+    stub.write_text(f"#!{sys.executable}\n{STUB_NEXTCLADE}")
+    stub.chmod(0o755)
+    for name, content in FASTA_FILES.items():
+        (tmp_path / 'fasta').mkdir(exist_ok=True)
+        (tmp_path / 'fasta' / name).write_text(content)
+    for dataset in ('H5_HA', 'H7_HA'):
+        (tmp_path / 'datasets' / dataset).mkdir(parents=True)
+        (tmp_path / 'datasets' / dataset / 'reference.fasta').write_text(f">{dataset}\nACGT\n")
+    return tmp_path
+
+def run_driver(workspace, output_dir, *options):
+    env = dict(os.environ, STUB_LOG=str(workspace / 'stub.log'))
+    cmd = [
+        sys.executable, RUN_NEXTCLADE, '-i', str(workspace / 'fasta'), '-d', str(workspace / 'datasets'),
+        '-o', str(workspace / output_dir), '-c', '2', '-n', str(workspace / 'nextclade'), *options
+    ]
+    return subprocess.run(cmd, env=env, capture_output=True, text=True)
+
+def read_outputs(output_dir):
+    return {name: (output_dir / f"{name}.tsv").read_text() for name in ('H5_HA', 'H7_HA')}
+
+def stub_runs(workspace):
+    runs = (workspace / 'stub.log').read_text().split() if (workspace / 'stub.log').exists() else []
+    (workspace / 'stub.log').unlink(missing_ok=True)
+    return sorted(zip(runs[::2], map(int, runs[1::2])))
+
+def test_unsharded_run(workspace):
+    assert run_driver(workspace, 'out').returncode == 0
+    assert read_outputs(workspace / 'out') == {name: expected_tsv(name) for name in ('H5_HA', 'H7_HA')}
+    assert stub_runs(workspace) == [('H5_HA', 4), ('H7_HA', 4)]
+    assert not (workspace / 'out' / '.nextclade_work').exists()
+
+def test_sharded_run_renumbers_index(workspace):
+    # Every shard's own index starts at 0; the merged TSV must count through all of them
+    assert run_driver(workspace, 'out', '-s', '1').returncode == 0
+    assert read_outputs(workspace / 'out') == {name: expected_tsv(name) for name in ('H5_HA', 'H7_HA')}
+    assert stub_runs(workspace) == [('H5_HA', 1)] * 4 + [('H7_HA', 1)] * 4
+
+def test_cached_run(workspace):
+    cache = str(workspace / 'cache.sqlite')
+    assert run_driver(workspace, 'first', '--cache', cache).returncode == 0
+    # s1 and s4 share a sequence, so only three sequences are run
+    assert stub_runs(workspace) == [('H5_HA', 3), ('H7_HA', 3)]
+
+    (workspace / 'fasta' / 'c.fasta').write_text('>s5\nCCCC\n')
+    assert run_driver(workspace, 'second', '--cache', cache, '-s', '1').returncode == 0
+    assert stub_runs(workspace) == [('H5_HA', 1), ('H7_HA', 1)]
+
+    assert read_outputs(workspace / 'first') == {name: expected_tsv(name) for name in ('H5_HA', 'H7_HA')}
+    assert read_outputs(workspace / 'second') == {name: expected_tsv(name) + f"4\ts5\t{name}\tHA:A4C\n" for name in ('H5_HA', 'H7_HA')}
+
+@pytest.mark.parametrize('options', [(), ('-s', '1'), ('--cache', 'cache.sqlite')])
+def test_failed_dataset_exits_non_zero(workspace, options):
+    (workspace / 'datasets' / 'H7_HA' / 'FAIL').write_text('')
+    options = [str(workspace / option) if option.endswith('.sqlite') else option for option in options]
+    result = run_driver(workspace, 'out', *options)
+    assert result.returncode != 0
+    assert "Error running Nextclade on dataset 'H7_HA'" in result.stderr
+
+def test_dataset_update_invalidates_cache(workspace):
+    cache = str(workspace / 'cache.sqlite')
+    assert run_driver(workspace, 'first', '--cache', cache).returncode == 0
+    stub_runs(workspace)
+
+    # Any dataset file can change the results, e.g. a new tree changes clades and QC scores
+    (workspace / 'datasets' / 'H5_HA' / 'tree.json').write_text('{}')
+    assert run_driver(workspace, 'second', '--cache', cache).returncode == 0
+    assert stub_runs(workspace) == [('H5_HA', 3)]
+    assert read_outputs(workspace / 'second') == read_outputs(workspace / 'first')
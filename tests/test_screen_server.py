@@ -0,0 +1,85 @@
+import os
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer
+import pytest
+from mutation_panel import compile_panel, write_panel
+from mutation_screen import load_curated_mutations, load_gene_map, process_file
+from screen_client import ScreeningClient, read_batches, write_results
+from screen_server import ScreeningHandler, ScreeningService
+
+DATASETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'nextclade_datasets')
+
+ANTIVIRAL_CSV = """\
+Gene,AminoAcid,Combination,Reason_for_Inclusion
+HA,Q187T,No,test
+HA,Q279X,No,test
+HA,T215I,No,test
+HA,Q187T+T215T,Yes,test
+"""
+
+RECEPTOR_CSV = """\
+Gene,AminoAcid,Combination,Reason_for_Inclusion
+HA,N38C,No,test
+HA,K100-,No,test
+HA,N38C+K100K,Yes,test
+"""
+
+# HA codon 187 is nucleotides 628-630 of the H5_HA reference: s4 starts after it and s5 has it masked
+NEXTCLADE_TSV = """\
+seqName\taaSubstitutions\taaDeletions\taaInsertions\talignmentStart\talignmentEnd\tmissing
+s1\tHA:Q187T,HA:Q187T\t\t\t1\t1760\t
+s2\tHA:Q279R,HA:T215I\tHA:K100-\t\t1\t1760\t
+s3\tHA:N38C\t\tHA:50:KK\t1\t1760\t
+s4\tHA:N38C\t\t\t700\t1760\t
+s5\tHA:T215I\t\t\t1\t1760\t620-640,900
+"""
+
+@pytest.fixture
+def server(tmp_path):
+    mutations = tmp_path / 'mutations'
+    mutations.mkdir()
+    (mutations / 'antiviral.csv').write_text(ANTIVIRAL_CSV)
+    (tmp_path / 'receptor.csv').write_text(RECEPTOR_CSV)
+    write_panel(compile_panel(str(tmp_path / 'receptor.csv')), str(mutations / 'receptor.panel.pkl'))
+    # An outdated panel next to its CSV must not be served in place of the CSV
+    (tmp_path / 'old.csv').write_text(ANTIVIRAL_CSV.replace('HA,T215I,No,test\n', ''))
+    write_panel(compile_panel(str(tmp_path / 'old.csv')), str(mutations / 'antiviral.panel.pkl'))
+
+    handler = type('Handler', (ScreeningHandler,), {'service': ScreeningService(str(mutations), DATASETS)})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, mutations
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_client_matches_mutation_screen(server, tmp_path):
+    httpd, mutations = server
+    (tmp_path / 'input.tsv').write_text(NEXTCLADE_TSV)
+    client = ScreeningClient(f"http://127.0.0.1:{httpd.server_address[1]}")
+
+    health = asyncio.run(client.health())
+    assert health['panels'] == ['antiviral', 'receptor']
+    batches = list(read_batches(str(tmp_path / 'input.tsv'), 2))
+    responses = asyncio.run(client.screen_batches(batches, dataset='H5_HA', jobs=2))
+    write_results(responses, str(tmp_path / 'served'))
+
+    gene_map = load_gene_map(os.path.join(DATASETS, 'H5_HA'))
+    for panel, mutation_file in [('antiviral', 'antiviral.csv'), ('receptor', 'receptor.panel.pkl')]:
+        expected_prefix = str(tmp_path / f"expected_{panel}")
+        process_file(str(tmp_path / 'input.tsv'), expected_prefix, *load_curated_mutations(str(mutations / mutation_file)), gene_map=gene_map)
+        for suffix in ('_summary.csv', '_freq_summary.csv'):
+            assert (tmp_path / f"served_{panel}{suffix}").read_bytes() == (tmp_path / f"expected_{panel}{suffix}").read_bytes()
+
+@pytest.mark.parametrize('payload, message', [
+    ([1], 'Request body must be a JSON object.'),
+    ({'rows': [{'seqName': 's1'}], 'panels': ['missing']}, 'Unknown panels: missing'),
+    ({'rows': [{'aaSubstitutions': 'HA:Q187T'}]}, "Rows must contain a 'seqName' column."),
+])
+def test_invalid_requests_are_rejected(server, payload, message):
+    httpd, _ = server
+    client = ScreeningClient(f"http://127.0.0.1:{httpd.server_address[1]}")
+    with pytest.raises(RuntimeError, match='returned 400') as error:
+        asyncio.run(client.request('POST', '/screen', payload))
+    assert message in str(error.value)